@@ -0,0 +1,134 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Metrics of outbound Google API calls, by API method.
+
+MeteredHttpRequest (the request builder of discovery_cache) and
+MeteredBatchHttpRequest (used by write_behind) record in the stats registry,
+for each API method id (e.g. 'mirror.timeline.get'):
+
+  api:<method>                 latency timer of the calls;
+  api:<method>:status:<code>   number of calls per final HTTP status;
+  api:<method>:bytes           total size of the response bodies;
+  api:<method>:retries         HTTP requests made beyond the first one, such
+                               as token refreshes and retried requests.
+
+Each part of a batch is also recorded under api:<method>:batched and its
+status. The calls made while handling an inbound request are added up per
+route under calls_per_request:<route>, and the ones of requests making more
+than CALLS_LOGGED_PER_REQUEST calls are logged, which points at N+1 access
+patterns.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from apiclient.http import BatchHttpRequest
+from apiclient.http import HttpRequest
+
+import stats
+
+
+# Inbound requests making more API calls than this have them logged.
+CALLS_LOGGED_PER_REQUEST = 5
+
+
+_local = threading.local()
+
+
+class _Call(object):
+  """HTTP requests made by one API call."""
+
+  def __init__(self):
+    self.attempts = 0
+    self.status = None
+    self.size = 0
+
+
+def start_request():
+  """Starts counting the API calls of an inbound request on this thread."""
+  _local.request_calls = collections.Counter()
+
+
+def finish_request(route):
+  """Records the API calls of the inbound request handled on this thread."""
+  calls = getattr(_local, 'request_calls', None)
+  _local.request_calls = None
+  if calls is None:
+    return
+  total = sum(calls.values())
+  stats.increment('calls_per_request:' + route, total)
+  if total > CALLS_LOGGED_PER_REQUEST:
+    logging.info(
+        '%s made %d API calls: %s', route, total,
+        ', '.join('%s x%d' % item for item in calls.most_common()))
+
+
+def _count_request_call(method_id):
+  calls = getattr(_local, 'request_calls', None)
+  if calls is not None:
+    calls[method_id] += 1
+
+
+def record_response(response, content):
+  """Records an HTTP response received by the current API call, if any.
+
+  Called by http_pool for every HTTP request it performs.
+  """
+  call = getattr(_local, 'call', None)
+  if call is not None:
+    call.attempts += 1
+    call.status = response.status
+    call.size += len(content or '')
+
+
+def _execute(method_id, execute):
+  """Calls execute() and records it as an API call of method_id."""
+  call = _local.call = _Call()
+  start = time.time()
+  try:
+    return execute()
+  finally:
+    _local.call = None
+    stats.record('api:' + method_id, time.time() - start)
+    _count_request_call(method_id)
+    if call.status is not None:
+      stats.increment('api:%s:status:%d' % (method_id, call.status))
+    stats.increment('api:%s:bytes' % method_id, call.size)
+    if call.attempts > 1:
+      stats.increment('api:%s:retries' % method_id, call.attempts - 1)
+
+
+class MeteredHttpRequest(HttpRequest):
+  """HttpRequest recording its calls by API method."""
+
+  def execute(self, *args, **kwargs):
+    return _execute(
+        self.methodId or 'unknown',
+        lambda: HttpRequest.execute(self, *args, **kwargs))
+
+
+class MeteredBatchHttpRequest(BatchHttpRequest):
+  """BatchHttpRequest recording the batch and each of its parts."""
+
+  def execute(self, *args, **kwargs):
+    _execute('batch', lambda: BatchHttpRequest.execute(self, *args, **kwargs))
+    for request_id, (response, content) in self._responses.iteritems():
+      method_id = getattr(
+          self._requests[request_id], 'methodId', None) or 'unknown'
+      stats.increment('api:%s:batched' % method_id)
+      stats.increment('api:%s:status:%d' % (method_id, response.status))
+      stats.increment('api:%s:bytes' % method_id, len(content or ''))
@@ -0,0 +1,199 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Denormalized per-user index of counters (see model.CounterIndex).
+
+The index is kept up to date by the handlers that create, change and delete
+counters, and is periodically reconciled against the user's timeline to
+repair any drift.
+
+Each entry records when it was last changed, and removed counters leave a
+tombstone entry until the next reconciliation. Listing the timeline is not
+transactional, so reconcile() keeps the entries changed since it started
+listing instead of overwriting them with what it listed.
+"""
+
+import datetime
+import json
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+from model import CounterIndex
+import counter_store
+import custom_item_fields
+
+
+RECONCILE_URL = '/tasks/reconcile_index'
+
+
+def get_counters(userid):
+  """Returns the indexed counters of a user, newest first.
+
+  This is the order in which the timeline lists them.
+
+  Each counter is a dictionary shaped like a timeline item as used by the
+  main page template: {'id': ..., 'created': ..., 'sourceItemId': {'name':
+  ..., 'num': ...}}. Returns None until the user's index is reconciled for
+  the first time.
+  """
+  index = CounterIndex.get_by_key_name(userid)
+  if index is None or index.reconciled is None:
+    return None
+  counters = []
+  for item_id, entry in json.loads(index.counters).iteritems():
+    if entry.get('removed'):
+      continue
+    counters.append({
+        'id': item_id,
+        'created': entry.get('created'),
+        'sourceItemId': {'name': entry.get('name'), 'num': entry.get('num')}
+    })
+  counters.sort(key=lambda counter: counter['created'], reverse=True)
+  return counters
+
+
+def _update(userid, updates):
+  """Transactionally applies updates to counter entries of a user's index.
+
+  The index is created if needed, so that changes made before the first
+  reconciliation are merged into it.
+
+  Args:
+    userid: ID of the user owning the index.
+    updates: Dictionary mapping item IDs to callables updating their entry.
+  """
+
+  def txn():
+    index = (CounterIndex.get_by_key_name(userid) or
+             CounterIndex(key_name=userid))
+    counters = json.loads(index.counters)
+    changed = time.time()
+    for item_id, update in updates.iteritems():
+      entry = counters.get(item_id)
+      if entry is None or entry.get('removed'):
+        entry = counters[item_id] = {}
+      update(entry)
+      entry['changed'] = changed
+    index.counters = json.dumps(counters)
+    index.put()
+  db.run_in_transaction(txn)
+
+
+def _put_entry(name, num, created):
+  """Returns an update setting the name, value and creation time."""
+
+  def update(entry):
+    entry['name'] = name
+    entry['num'] = num
+    if created is not None:
+      entry['created'] = created
+  return update
+
+
+def put_counter(userid, item_id, name, num, created=None):
+  """Adds or updates a counter in a user's index."""
+  _update(userid, {item_id: _put_entry(name, num, created)})
+
+
+def put_counters(userid, entries):
+  """Adds or updates counters in a user's index in a single transaction.
+
+  Args:
+    userid: ID of the user owning the index.
+    entries: List of (item_id, name, num, created) tuples, where created
+      may be None.
+  """
+  if entries:
+    _update(userid, dict(
+        (item_id, _put_entry(name, num, created))
+        for item_id, name, num, created in entries))
+
+
+def remove_counter(userid, item_id):
+  """Removes a counter from a user's index."""
+  _update(userid, {item_id: lambda entry: entry.update(removed=True)})
+
+
+def schedule_reconcile(userid):
+  """Schedules a reconciliation of a user's index with their timeline."""
+  # Page loads before the first index is built must not pile up tasks.
+  if memcache.add('reconcile:' + userid, 1, time=60):
+    taskqueue.add(url=RECONCILE_URL, params={'userid': userid})
+
+
+def reconcile(userid, mirror_service):
+  """Rebuilds a user's index from their timeline.
+
+  Counter values come from the counter store when it holds the counter, as
+  the timeline card may not have been updated yet. Entries changed while the
+  timeline was being listed take precedence over the listed items.
+  """
+  started = time.time()
+  counters = {}
+  timeline = mirror_service.timeline()
+  request = timeline.list()
+  while request is not None:
+    response = request.execute()
+    for item in response.get('items', []):
+      fields = custom_item_fields.FieldView(item)
+      counters[item['id']] = {
+          'name': fields.get('name'),
+          'num': fields.get('num'),
+          'created': item.get('created')
+      }
+    request = timeline.list_next(request, response)
+
+  for counter in counter_store.get_multi(counters.keys()):
+    if counter is not None:
+      counters[counter.key().name()]['num'] = counter_store.get_value(counter)
+
+  def txn():
+    index = (CounterIndex.get_by_key_name(userid) or
+             CounterIndex(key_name=userid))
+    merged = dict(counters)
+    for item_id, entry in json.loads(index.counters).iteritems():
+      if entry.get('changed', 0) < started:
+        continue
+      if entry.get('removed'):
+        # Kept until the next reconciliation, which lists without the item.
+        merged[item_id] = entry
+      else:
+        merged[item_id] = dict(counters.get(item_id, {}), **entry)
+    index.counters = json.dumps(merged)
+    index.reconciled = datetime.datetime.utcfromtimestamp(started)
+    index.put()
+  db.run_in_transaction(txn)
+
+
+def schedule_reconcile_batch(cursor=None, batch_size=100):
+  """Schedules the reconciliation of a batch of indexed users.
+
+  Args:
+    cursor: Datastore cursor returned by a previous call, or None.
+    batch_size: Number of users scheduled per call.
+  Returns:
+    Cursor to continue with, or None if the batch was the last one.
+  """
+  query = CounterIndex.all(keys_only=True)
+  if cursor:
+    query.with_cursor(cursor)
+  keys = query.fetch(batch_size)
+  for key in keys:
+    schedule_reconcile(key.name())
+  if len(keys) < batch_size:
+    return None
+  return query.cursor()
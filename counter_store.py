@@ -0,0 +1,212 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Authoritative server-side store for counter values.
+
+The value of a counter lives in the datastore (see model.Counter). Changing
+it is a local transactional write; the timeline card is a projection of the
+stored value that a task queue task (see tasks.handler) brings up to date
+shortly afterwards.
+"""
+
+import itertools
+import logging
+import random
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+from model import Counter
+from model import CounterShard
+
+
+# Counters gain a shard every time an increment fails because of contention.
+MAX_SHARDS = 20
+
+# Seconds to wait before projecting a counter on its timeline card. Changes
+# made in the meantime are picked up by the same projection.
+PROJECTION_DELAY = 1
+
+PROJECTION_URL = '/tasks/project_counter'
+
+
+def _shard_key(item_id, index):
+  """Returns the key of a counter's shard."""
+  return db.Key.from_path(CounterShard.kind(), '%s-%d' % (item_id, index))
+
+
+def _shard_keys(counter):
+  """Returns the keys of all the shards of a counter."""
+  item_id = counter.key().name()
+  return [_shard_key(item_id, index) for index in range(counter.num_shards)]
+
+
+def create(item_id, userid, name, num):
+  """Stores a new counter for the given timeline item."""
+  counter = Counter(key_name=item_id, userid=userid, name=name, base=num)
+  counter.put()
+  return counter
+
+
+def create_multi(entries):
+  """Stores new counters with a single datastore call.
+
+  Args:
+    entries: List of (item_id, userid, name, num) tuples.
+  Returns:
+    List of the stored Counters.
+  """
+  counters = [
+      Counter(key_name=item_id, userid=userid, name=name, base=num)
+      for item_id, userid, name, num in entries]
+  db.put(counters)
+  return counters
+
+
+def get(item_id):
+  """Returns the Counter for the given timeline item or None."""
+  return Counter.get_by_key_name(item_id)
+
+
+def get_multi(item_ids):
+  """Returns the Counters of the given timeline items, None when missing."""
+  return Counter.get_by_key_name(item_ids)
+
+
+def get_value(counter):
+  """Returns the current value of a counter."""
+  return get_values([counter])[0]
+
+
+def get_values(counters):
+  """Returns the current values of counters, reading their shards at once."""
+  keys = []
+  for counter in counters:
+    keys.extend(_shard_keys(counter))
+  shards = iter(db.get(keys))
+  values = []
+  for counter in counters:
+    value = counter.base
+    for shard in itertools.islice(shards, counter.num_shards):
+      if shard is not None and shard.generation == counter.generation:
+        value += shard.count
+    values.append(value)
+  return values
+
+
+def set_value(item_id, num, name=None):
+  """Sets the value (and optionally the name) of a counter.
+
+  Counters that are not in the store yet are left alone: they are seeded
+  from their timeline card when they are first changed from Glass.
+  """
+
+  def txn():
+    counter = Counter.get_by_key_name(item_id)
+    if counter is None:
+      return
+    counter.generation += 1
+    counter.base = num
+    if name is not None:
+      counter.name = name
+    counter.put()
+  db.run_in_transaction(txn)
+
+
+def apply_change(item_id, userid, change):
+  """Applies a notify.coalescer.CounterChange to a counter of a user.
+
+  The delta goes to a random shard so that concurrent changes rarely touch
+  the same entity; only a reset writes the Counter entity itself. Does
+  nothing if the counter does not exist, e.g. when it was deleted meanwhile,
+  or if it belongs to another user.
+  """
+  counter = Counter.get_by_key_name(item_id)
+  if counter is None or counter.userid != userid:
+    logging.info('Not changing counter %s for user %s', item_id, userid)
+    return
+  index = random.randint(0, counter.num_shards - 1)
+
+  def txn():
+    counter = Counter.get_by_key_name(item_id)
+    if counter is None or counter.userid != userid:
+      return
+    if change.reset:
+      counter.generation += 1
+      counter.base = 0
+      counter.put()
+    if change.delta:
+      shard_key = _shard_key(item_id, index)
+      shard = CounterShard.get(shard_key)
+      if shard is None:
+        shard = CounterShard(key=shard_key)
+      if shard.generation != counter.generation:
+        shard.count = 0
+        shard.generation = counter.generation
+      shard.count += change.delta
+      shard.put()
+
+  try:
+    db.run_in_transaction_options(db.create_transaction_options(xg=True), txn)
+  except db.TransactionFailedError:
+    _add_shard(item_id)
+    raise
+
+
+def _add_shard(item_id):
+  """Adds a shard to a counter that is too hot for its current shards."""
+
+  def txn():
+    counter = Counter.get_by_key_name(item_id)
+    if counter.num_shards < MAX_SHARDS:
+      counter.num_shards += 1
+      counter.put()
+  db.run_in_transaction(txn)
+  logging.info('Added a shard to counter %s', item_id)
+
+
+def delete(item_id, userid):
+  """Deletes a counter of a user and its shards.
+
+  Returns:
+    False if the counter belongs to another user and was left alone.
+  """
+  counter = Counter.get_by_key_name(item_id)
+  if counter is None:
+    return True
+  if counter.userid != userid:
+    return False
+  db.delete(_shard_keys(counter) + [counter.key()])
+  return True
+
+
+def schedule_projection(item_id):
+  """Schedules an update of the timeline card from the stored value.
+
+  At most one projection is pending per item: changes made before it runs
+  are included in it.
+  """
+  if memcache.add('projection:' + item_id, 1, time=PROJECTION_DELAY + 60):
+    taskqueue.add(
+        url=PROJECTION_URL, countdown=PROJECTION_DELAY,
+        params={'itemId': item_id})
+
+
+def clear_projection(item_id):
+  """Marks the pending projection of an item as started.
+
+  Changes made after this call schedule a new projection.
+  """
+  memcache.delete('projection:' + item_id)
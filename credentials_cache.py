@@ -0,0 +1,187 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Two-tier cache in front of the OAuth 2.0 credentials in the datastore.
+
+Deserialized credentials are kept in an in-process LRU cache, backed by a
+write-through memcache tier (the JSON form of the credentials), backed by the
+datastore. Storing refreshed credentials updates both tiers and deleting
+credentials invalidates them.
+
+The storage lock, which OAuth2Credentials holds while refreshing an access
+token, makes refreshes single-flight: a per-user lock within the instance and
+a memcache lease across instances. Requests waiting on the lock find the new
+token in storage when they get it and do not refresh again.
+"""
+
+import copy
+import threading
+import time
+
+from google.appengine.api import memcache
+from oauth2client.appengine import StorageByKeyName
+
+from model import Credentials
+import lru_cache
+import stats
+
+
+# Number of users whose credentials are kept by each instance.
+LOCAL_CACHE_SIZE = 1000
+
+# Seconds before an instance reloads credentials that may have been refreshed
+# by another instance.
+LOCAL_CACHE_TTL = 300
+
+MEMCACHE_NAMESPACE = 'credentials'
+
+# Seconds an instance may hold the refresh lease of a user.
+REFRESH_LEASE_TIME = 10
+
+# Seconds between checks while another instance holds the refresh lease.
+REFRESH_LEASE_POLL = 0.1
+
+# Number of in-process refresh locks. Users are spread over a fixed set of
+# locks so that memory does not grow with the number of users; users sharing
+# a lock only refresh one at a time.
+REFRESH_LOCK_STRIPES = 64
+
+
+LOCAL_CACHE = lru_cache.LRUCache(LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL)
+
+_refresh_locks = [threading.Lock() for _ in range(REFRESH_LOCK_STRIPES)]
+
+
+def _refresh_lock(key_name):
+  """Returns the in-process refresh lock of a user."""
+  return _refresh_locks[hash(key_name) % REFRESH_LOCK_STRIPES]
+
+
+class _MemcacheTier(object):
+  """Memcache client keeping credentials in their own namespace.
+
+  Handlers use the user ID as the memcache key of flash messages, so
+  credentials must not share the default namespace.
+  """
+
+  def get(self, key):
+    return memcache.get(key, namespace=MEMCACHE_NAMESPACE)
+
+  def set(self, key, value):
+    return memcache.set(key, value, namespace=MEMCACHE_NAMESPACE)
+
+  def delete(self, key):
+    return memcache.delete(key, namespace=MEMCACHE_NAMESPACE)
+
+
+class CachedStorageByKeyName(StorageByKeyName):
+  """StorageByKeyName with an in-process cache of deserialized credentials."""
+
+  def __init__(self, model, key_name, property_name):
+    """Initialize a new CachedStorageByKeyName.
+
+    Args:
+      model: db.Model, model class.
+      key_name: string, key name for the entity that has the credentials.
+      property_name: string, name of the property that is a
+        CredentialsProperty.
+    """
+    StorageByKeyName.__init__(
+        self, model, key_name, property_name, cache=_MemcacheTier())
+    self._locked = False
+    self._has_lease = False
+
+  # The storage lock is only needed around token refreshes, so plain reads and
+  # writes do not take it.
+
+  @stats.timed('credentials.get')
+  def get(self):
+    """Retrieve credential."""
+    return self.locked_get()
+
+  def put(self, credentials):
+    """Write a credential."""
+    self.locked_put(credentials)
+
+  def delete(self):
+    """Delete credential."""
+    self.locked_delete()
+
+  def _local_key(self):
+    return (self._model.kind(), self._key_name)
+
+  def _lease_key(self):
+    return 'refresh-lease:' + self._key_name
+
+  def acquire_lock(self):
+    """Acquires the refresh lock of the user, within and across instances.
+
+    If another instance holds the lease, waits until it is released (or
+    expires) so that the refreshed token can be read from memcache.
+    """
+    _refresh_lock(self._key_name).acquire()
+    self._locked = True
+    deadline = time.time() + REFRESH_LEASE_TIME
+    while True:
+      self._has_lease = memcache.add(
+          self._lease_key(), 1, time=REFRESH_LEASE_TIME,
+          namespace=MEMCACHE_NAMESPACE)
+      if self._has_lease or time.time() > deadline:
+        break
+      time.sleep(REFRESH_LEASE_POLL)
+
+  def release_lock(self):
+    """Releases the refresh lock of the user."""
+    if self._has_lease:
+      memcache.delete(self._lease_key(), namespace=MEMCACHE_NAMESPACE)
+      self._has_lease = False
+    self._locked = False
+    _refresh_lock(self._key_name).release()
+
+  def locked_get(self):
+    """Retrieve Credential from the cache tiers or the datastore.
+
+    While the refresh lock is held, the in-process tier is skipped so that a
+    token refreshed by another instance is seen.
+    """
+    credentials = None
+    if not self._locked:
+      credentials = LOCAL_CACHE.get(self._local_key())
+    if credentials is None:
+      credentials = StorageByKeyName.locked_get(self)
+      if credentials is None:
+        return None
+      LOCAL_CACHE.set(self._local_key(), credentials)
+    # Each caller gets its own copy: a refresh updates the credentials in
+    # place, and waiting callers must still see their old token to notice
+    # that it was refreshed.
+    credentials = copy.copy(credentials)
+    if hasattr(credentials, 'set_store'):
+      credentials.set_store(self)
+    return credentials
+
+  def locked_put(self, credentials):
+    """Write a Credentials to the datastore and both cache tiers."""
+    StorageByKeyName.locked_put(self, credentials)
+    LOCAL_CACHE.set(self._local_key(), copy.copy(credentials))
+
+  def locked_delete(self):
+    """Delete Credential from the datastore and both cache tiers."""
+    LOCAL_CACHE.delete(self._local_key())
+    StorageByKeyName.locked_delete(self)
+
+
+def get_storage(userid):
+  """Returns the cached Storage for the credentials of a user."""
+  return CachedStorageByKeyName(Credentials, userid, 'credentials')
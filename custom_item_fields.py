@@ -27,17 +27,23 @@ takes care of this by using jinja templates.
 
 __author__ = 'jewang.net (Jennifer Wang)'
 
-import jinja2
+import hashlib
 import json
-import os
 
-
-jinja_environment = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(os.path.dirname(__file__)))
+import lru_cache
+import stats
+import templating
 
 
 KEY = 'sourceItemId'
 
+# Number of rendered (template, fields) combinations kept in memory.
+RENDER_CACHE_SIZE = 500
+
+# Rendered html keyed by template and fields. Templates only depend on the
+# fields, and most items cycle through a small set of field values.
+RENDER_CACHE = lru_cache.LRUCache(RENDER_CACHE_SIZE)
+
 
 def get_fields_from_json(json_input):
   """Returns a dictionary from json_input."""
@@ -58,10 +64,81 @@ def get_json_from_fields(fields):
   return json.dumps(fields)
 
 
+def _render_cache_key(fields, template_url):
+  """Returns a stable cache key for a template and custom fields."""
+  digest = hashlib.sha1(json.dumps(fields, sort_keys=True)).hexdigest()
+  return '%s:%s' % (template_url, digest)
+
+
 def render_html_from_fields(fields, template_url):
-  """Returns html rendering of timeline item with custom fields data."""
-  template = jinja_environment.get_template(template_url)
-  return template.render(fields)
+  """Returns html rendering of timeline item with custom fields data.
+
+  Renderings are memoized in RENDER_CACHE. Cache hits and misses are counted
+  as render_cache:hit and render_cache:miss in the stats registry.
+  """
+  key = _render_cache_key(fields, template_url)
+  html = RENDER_CACHE.get(key)
+  if html is not None:
+    stats.increment('render_cache:hit')
+  else:
+    stats.increment('render_cache:miss')
+    template = templating.get_template(template_url)
+    html = template.render(fields)
+    RENDER_CACHE.set(key, html)
+  return html
+
+
+class FieldView(object):
+  """Parse-once view of the custom fields of a timeline item.
+
+  The fields are decoded from item['sourceItemId'] when the view is created.
+  Changes are tracked and only written back to the item, as one JSON
+  encoding and, if enabled, one template rendering, when commit() is called.
+  """
+
+  def __init__(self, item, template_url=''):
+    """Initialize a new FieldView.
+
+    Args:
+      item: Timeline item holding the custom fields.
+      template_url: Template used to render the item's html, if any.
+    """
+    self.item = item
+    self.template_url = template_url
+    self.fields = get_fields_from_item(item)
+    # Keys changed since the last commit, in the order they were set.
+    self.changed = []
+
+  def __getitem__(self, key):
+    return self.fields[key]
+
+  def get(self, key, default=None):
+    """Returns value associated with key, or default."""
+    return self.fields.get(key, default)
+
+  def set(self, key, val):
+    """Sets key->value custom field."""
+    if key not in self.fields or self.fields[key] != val:
+      self.fields[key] = val
+      if key not in self.changed:
+        self.changed.append(key)
+    return self
+
+  def update(self, new_fields):
+    """Sets key->value custom fields."""
+    for key, val in new_fields.iteritems():
+      self.set(key, val)
+    return self
+
+  def commit(self):
+    """Writes changed fields back to the item and returns the item."""
+    if self.changed:
+      self.item[KEY] = get_json_from_fields(self.fields)
+      if self.template_url:
+        self.item['html'] = render_html_from_fields(
+            self.fields, self.template_url)
+      self.changed = []
+    return self.item
 
 
 def get(item, key):
@@ -81,15 +158,7 @@ def set_multiple(item, new_fields, template_url=''):
   To do this, this method updates a timeline item's sourceItemId
   and, if enabled, template html.
 
-  Generating JSON and rendering html with each call could cause
-  performance issues on larger scale Glassware.
+  Each call decodes, encodes and renders the fields once; use a FieldView
+  to combine several changes to the same item.
   """
-  fields = get_fields_from_item(item)
-  fields.update(new_fields)
-
-  item['sourceItemId'] = get_json_from_fields(fields)
-  if template_url:
-    item['html'] = render_html_from_fields(
-        fields, template_url)
-
-  return item
+  return FieldView(item, template_url).update(new_fields).commit()
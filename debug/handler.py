@@ -0,0 +1,39 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Request Handlers for /debug endpoints, restricted to admins in app.yaml."""
+
+
+import json
+import webapp2
+
+import stats
+
+
+class StatsHandler(webapp2.RequestHandler):
+  """Request Handler exporting the instance's stats registry."""
+
+  def get(self):
+    """Return the metrics of this instance as JSON."""
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps(stats.snapshot(), sort_keys=True))
+
+  def post(self):
+    """Clear the metrics of this instance."""
+    stats.reset()
+
+
+DEBUG_ROUTES = [
+    ('/debug/stats', StatsHandler)
+]
@@ -0,0 +1,211 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Process-wide cache of discovery documents and generated Resource classes.
+
+apiclient.discovery.build fetches, parses and walks the discovery document
+each time it is called, creating a closure for every API method on every
+Resource instance. This module does that work once per (service, version)
+and per process: the parsed document, the request model and a Resource class
+whose API methods are plain class attributes are kept in memory, so building
+a service only instantiates that class around an http object.
+
+Discovery documents are seeded from the discovery/ directory bundled with the
+application (named <service>.<version>.json). Services without a bundled
+document are fetched once from the discovery service and then cached.
+
+A bundled document always wins over the discovery service, and the bundled
+documents are trimmed to what this application calls. mirror.v1.json only
+has the timeline (delete, get, insert, list, patch, update) and
+subscriptions (delete, insert, list, update) resources, without media
+upload; attachments, contacts, locations, settings and accounts are left
+out. oauth2.v2.json only has userinfo. To call anything else, replace the
+bundled file with the full document from the discovery service.
+
+Setting the GOOGLE_API_ROOT_URL environment variable sends all API requests
+to another server, such as the emulator in tools/mirror_emulator.py.
+"""
+
+import json
+import logging
+import os
+import threading
+import urlparse
+
+import httplib2
+import uritemplate
+from apiclient.discovery import DISCOVERY_URI
+from apiclient.discovery import createMethod
+from apiclient.discovery import createNextMethod
+from apiclient.discovery import fix_method_name
+from apiclient.discovery import Resource
+from apiclient.errors import HttpError
+from apiclient.errors import UnknownApiNameOrVersion
+from apiclient.model import JsonModel
+from apiclient.schema import Schemas
+
+import api_metrics
+
+
+DISCOVERY_DIR = os.path.join(os.path.dirname(__file__), 'discovery')
+
+# Replaces the rootUrl of every discovery document when set.
+API_ROOT_URL = os.environ.get('GOOGLE_API_ROOT_URL')
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class _GeneratedResource(Resource):
+  """Resource whose API methods are defined on the class, not the instance."""
+
+  def _set_service_methods(self):
+    # Methods were attached once to the generated class by _resource_class.
+    pass
+
+
+class _CachedService(object):
+  """Parsed discovery document and the Resource class generated from it."""
+
+  def __init__(self, document):
+    """Initialize a new _CachedService from a parsed discovery document."""
+    self.document = document
+    self.base_url = urlparse.urljoin(
+        document['rootUrl'], document['servicePath'])
+    self.batch_uri = urlparse.urljoin(
+        document['rootUrl'], document.get('batchPath', 'batch'))
+    self.model = JsonModel('dataWrapper' in document.get('features', []))
+    self.schema = Schemas(document)
+    self.resource_class = _resource_class(
+        document['id'], document, document, self.schema)
+
+  def build(self, http):
+    """Returns a new Resource for this service using the given http."""
+    return self.resource_class(
+        http=http, baseUrl=self.base_url, model=self.model,
+        requestBuilder=api_metrics.MeteredHttpRequest, developerKey=None,
+        resourceDesc=self.document, rootDesc=self.document,
+        schema=self.schema)
+
+
+def _nested_resource_method(resource_class, resource_desc):
+  """Returns a method that instantiates a nested Resource class."""
+
+  def method_resource(self):
+    return resource_class(
+        http=self._http, baseUrl=self._baseUrl, model=self._model,
+        requestBuilder=self._requestBuilder, developerKey=self._developerKey,
+        resourceDesc=resource_desc, rootDesc=self._rootDesc,
+        schema=self._schema)
+
+  method_resource.__doc__ = 'A collection resource.'
+  method_resource.__is_resource__ = True
+  return method_resource
+
+
+def _resource_class(name, resource_desc, root_desc, schema):
+  """Generates a Resource class for a section of a discovery document.
+
+  This mirrors what Resource._set_service_methods does for each instance, but
+  attaches the methods to a class so that the work is only done once.
+  """
+  attrs = {}
+  for method_name, method_desc in resource_desc.get('methods', {}).iteritems():
+    fixed_name, method = createMethod(
+        method_name, method_desc, root_desc, schema)
+    attrs[fixed_name] = method
+    if method_desc.get('supportsMediaDownload', False):
+      fixed_name, method = createMethod(
+          method_name + '_media', method_desc, root_desc, schema)
+      attrs[fixed_name] = method
+
+  for resource_name, nested_desc in (
+      resource_desc.get('resources', {}).iteritems()):
+    nested_class = _resource_class(
+        '%s.%s' % (name, resource_name), nested_desc, root_desc, schema)
+    attrs[fix_method_name(resource_name)] = _nested_resource_method(
+        nested_class, nested_desc)
+
+  for method_name, method_desc in resource_desc.get('methods', {}).iteritems():
+    response_schema = method_desc.get('response')
+    if response_schema is None:
+      continue
+    if '$ref' in response_schema:
+      response_schema = schema.get(response_schema['$ref'])
+    if ('nextPageToken' in response_schema.get('properties', {}) and
+        'pageToken' in method_desc.get('parameters', {})):
+      fixed_name, method = createNextMethod(method_name + '_next')
+      attrs[fixed_name] = method
+
+  return type(str(name.replace(':', '_')), (_GeneratedResource,), attrs)
+
+
+def _load_bundled_document(service, version):
+  """Returns the bundled discovery document content or None."""
+  path = os.path.join(DISCOVERY_DIR, '%s.%s.json' % (service, version))
+  if not os.path.exists(path):
+    return None
+  with open(path) as document_file:
+    return document_file.read()
+
+
+def _fetch_document(service, version):
+  """Fetches a discovery document from the discovery service."""
+  discovery_uri = DISCOVERY_URI
+  if API_ROOT_URL:
+    discovery_uri = urlparse.urljoin(
+        API_ROOT_URL, 'discovery/v1/apis/{api}/{apiVersion}/rest')
+  url = uritemplate.expand(
+      discovery_uri, {'api': service, 'apiVersion': version})
+  logging.info('Fetching discovery document: %s', url)
+  resp, content = httplib2.Http().request(url)
+  if resp.status == 404:
+    raise UnknownApiNameOrVersion(
+        'name: %s  version: %s' % (service, version))
+  if resp.status >= 400:
+    raise HttpError(resp, content, uri=url)
+  return content
+
+
+def get_service(service, version):
+  """Returns the _CachedService for service and version, loading it once."""
+  key = (service, version)
+  cached = _cache.get(key)
+  if cached is None:
+    with _cache_lock:
+      cached = _cache.get(key)
+      if cached is None:
+        content = _load_bundled_document(service, version)
+        if content is None:
+          content = _fetch_document(service, version)
+        document = json.loads(content)
+        if API_ROOT_URL:
+          document['rootUrl'] = API_ROOT_URL
+        cached = _CachedService(document)
+        _cache[key] = cached
+  return cached
+
+
+def build(service, version, http):
+  """Returns a Resource for the service, built from the process-wide cache.
+
+  Args:
+    service: Service name (e.g 'mirror', 'oauth2').
+    version: Service version (e.g 'v1').
+    http: httplib2.Http (or equivalent) used to make API requests.
+  Returns:
+    Resource object with methods for interacting with the service.
+  """
+  return get_service(service, version).build(http)
@@ -0,0 +1,97 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared pool of keep-alive httplib2.Http objects.
+
+An httplib2.Http object keeps one persistent connection per scheme and
+authority, but it is not safe to use from several threads at once. The pool
+hands out an idle Http object for the duration of a single HTTP request and
+takes it back afterwards, so that concurrent requests on a threadsafe instance
+reuse the same open connections to the API host.
+
+Credentials are never applied to the pooled objects themselves: PooledHttp
+is a lightweight per-request facade that Credentials.authorize() can wrap,
+which adds the user's Authorization header to each request it forwards.
+"""
+
+import threading
+
+import httplib2
+
+import api_metrics
+
+
+# Maximum number of idle Http objects kept per process.
+MAX_IDLE_CONNECTIONS = 20
+
+
+class HttpPool(object):
+  """Thread-safe pool of idle httplib2.Http objects."""
+
+  def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+    """Initialize a new HttpPool keeping at most max_idle Http objects."""
+    self._max_idle = max_idle
+    self._idle = []
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    """Returns an Http object for the exclusive use of the caller."""
+    with self._lock:
+      if self._idle:
+        return self._idle.pop()
+    return httplib2.Http()
+
+  def release(self, http):
+    """Returns an Http object acquired from this pool."""
+    with self._lock:
+      if len(self._idle) < self._max_idle:
+        self._idle.append(http)
+        return
+    for connection in http.connections.values():
+      connection.close()
+
+  def request(self, *args, **kwargs):
+    """Performs an HTTP request on a pooled Http object.
+
+    Takes the same arguments as httplib2.Http.request.
+    """
+    http = self.acquire()
+    try:
+      response = http.request(*args, **kwargs)
+    except:
+      # The connection may be left in an unknown state: drop it.
+      for connection in http.connections.values():
+        connection.close()
+      raise
+    self.release(http)
+    api_metrics.record_response(*response)
+    return response
+
+
+POOL = HttpPool()
+
+
+class PooledHttp(object):
+  """Per-request stand-in for httplib2.Http backed by the shared pool.
+
+  Authorize it with Credentials.authorize() to sign requests for a user.
+  """
+
+  def __init__(self, pool=None):
+    """Initialize a new PooledHttp drawing connections from pool."""
+    self._pool = pool or POOL
+
+  def request(self, *args, **kwargs):
+    """Performs an HTTP request on a pooled connection."""
+    return self._pool.request(*args, **kwargs)
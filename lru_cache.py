@@ -0,0 +1,78 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bounded, thread-safe in-process LRU cache."""
+
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+  """Thread-safe least-recently-used cache with optional expiration."""
+
+  def __init__(self, max_size, ttl=None):
+    """Initialize a new LRUCache.
+
+    Args:
+      max_size: Maximum number of entries kept in the cache.
+      ttl: Seconds after which an entry expires, or None to keep entries
+        until they are evicted.
+    """
+    self._max_size = max_size
+    self._ttl = ttl
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, default=None):
+    """Returns the value cached for key, or default."""
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is not None:
+        value, expires = entry
+        if expires is None or expires > time.time():
+          # Re-insert the entry to mark it as the most recently used.
+          self._entries[key] = entry
+          self.hits += 1
+          return value
+      self.misses += 1
+      return default
+
+  def set(self, key, value):
+    """Caches value for key, evicting the least recently used entry."""
+    expires = None
+    if self._ttl is not None:
+      expires = time.time() + self._ttl
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = (value, expires)
+      if len(self._entries) > self._max_size:
+        self._entries.popitem(last=False)
+
+  def delete(self, key):
+    """Removes key from the cache."""
+    with self._lock:
+      self._entries.pop(key, None)
+
+  def __contains__(self, key):
+    """Returns whether key is cached, without counting a hit or a miss."""
+    with self._lock:
+      entry = self._entries.get(key)
+      return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+  def __len__(self):
+    """Returns the number of entries in the cache."""
+    return len(self._entries)
@@ -21,18 +21,40 @@ __author__ = 'alainv@google.com (Alain Vongsouvanh)'
 import sys
 sys.path.insert(0, 'lib')
 
+import time
 import webapp2
 
+import api_metrics
+from debug.handler import DEBUG_ROUTES
 from main_handler import MAIN_ROUTES
 from notify.handler import NOTIFY_ROUTES
 from oauth.handler import OAUTH_ROUTES
 from signout.handler import SIGNOUT_ROUTES
 from subscription.handler import SUBSCRIPTION_ROUTES
+from tasks.handler import TASK_ROUTES
+import stats
 
 
 ROUTES = (
     MAIN_ROUTES + NOTIFY_ROUTES + OAUTH_ROUTES + SIGNOUT_ROUTES +
-    SUBSCRIPTION_ROUTES)
+    SUBSCRIPTION_ROUTES + TASK_ROUTES + DEBUG_ROUTES)
 
 
+def _dispatch(router, request, response):
+  """Dispatch a request and record its latency under its route."""
+  start = time.time()
+  api_metrics.start_request()
+  try:
+    return router.default_dispatcher(request, response)
+  finally:
+    route = '%s %s' % (
+        request.method,
+        getattr(getattr(request, 'route', None), 'template', 'unmatched'))
+    stats.record('route:' + route, time.time() - start)
+    api_metrics.finish_request(route)
+
+
+stats.install_rpc_hooks()
+
 app = webapp2.WSGIApplication(ROUTES)
+app.router.set_dispatcher(_dispatch)
@@ -17,45 +17,92 @@
 __author__ = 'jewang.net (Jennifer Wang)'
 
 
-import jinja2
+import collections
+import itertools
 import logging
-import os
+import urllib
 import webapp2
 
 from apiclient.http import HttpError
 from google.appengine.api import memcache
 
+import counter_index
+import counter_store
 import custom_item_fields
+from notify import coalescer
+from subscription import registry
+import templating
 import util
-
-
-jinja_environment = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(os.path.dirname(__file__)))
+import write_behind
 
 
 TIMELINE_ITEM_TEMPLATE_URL = '/templates/card.html'
 
-
-class _BatchCallback(object):
-  """Class used to track batch request responses."""
-
-  def __init__(self):
-    """Initialize a new _BatchCallbaclk object."""
-    self.success = 0
-    self.failure = 0
-
-  def callback(self, request_id, response, exception):
-    """Method called on each HTTP Response from a batch request.
-
-    For more information, see
-      https://developers.google.com/api-client-library/python/guide/batch
-    """
-    if exception is None:
-      self.success += 1
-    else:
-      self.failure += 1
-      logging.error(
-          'Failed to insert item for user %s: %s', request_id, exception)
+# Number of timeline items requested per Mirror API call.
+TIMELINE_PAGE_SIZE = 25
+
+# Number of counters listed per page of the web interface. This should be a
+# multiple of TIMELINE_PAGE_SIZE so that web pages end on an API page.
+HTML_PAGE_SIZE = 100
+
+
+class _TimelinePager(object):
+  """Lazily iterates over the timeline items of one page of the main page.
+
+  Mirror API pages are only requested as the template consumes the items,
+  following nextPageToken until HTML_PAGE_SIZE items have been listed.
+  """
+
+  def __init__(self, mirror_service, page_token=None):
+    """Initialize a new _TimelinePager starting at page_token."""
+    self._mirror_service = mirror_service
+    self._page_token = page_token
+    self.next_page_token = None
+
+  def __iter__(self):
+    timeline = self._mirror_service.timeline()
+    request = timeline.list(
+        maxResults=TIMELINE_PAGE_SIZE, pageToken=self._page_token or None)
+    count = 0
+    while request is not None:
+      response = request.execute()
+      items = response.get('items', [])
+      for item in items:
+        # turn sourceItemId JSON string into a dictionary for templating
+        item['sourceItemId'] = custom_item_fields.get_fields_from_item(item)
+        yield item
+      count += len(items)
+      self.next_page_token = response.get('nextPageToken')
+      if count >= HTML_PAGE_SIZE:
+        break
+      request = timeline.list_next(request, response)
+
+  @property
+  def next_page_url(self):
+    """URL of the next page of the main page, once iteration is over."""
+    if self.next_page_token:
+      return '/?' + urllib.urlencode({'pageToken': self.next_page_token})
+    return None
+
+
+class _IndexPager(object):
+  """Iterates over one page of the main page from the counter index."""
+
+  def __init__(self, counters, offset=0):
+    """Initialize a new _IndexPager over counters, starting at offset."""
+    self._counters = counters
+    self._offset = max(offset, 0)
+
+  def __iter__(self):
+    return iter(self._counters[self._offset:self._offset + HTML_PAGE_SIZE])
+
+  @property
+  def next_page_url(self):
+    """URL of the next page of the main page, if any."""
+    next_offset = self._offset + HTML_PAGE_SIZE
+    if next_offset < len(self._counters):
+      return '/?' + urllib.urlencode({'offset': next_offset})
+    return None
 
 
 class MainHandler(webapp2.RequestHandler):
@@ -66,21 +113,26 @@ class MainHandler(webapp2.RequestHandler):
     template_values = {'userId': self.userid}
     if message:
       template_values['message'] = message
-    # self.mirror_service is initialized in util.auth_required.
-    timeline = self.mirror_service.timeline().list().execute()
-    timeline_items = timeline.get('items', [])
-
-    # sort timeline items
-    timeline_items.sort(key=lambda x: x['created'])
-
-    # turn sourceItemId JSON string into a dictionary for templating
-    for item in timeline_items:
-      fields = custom_item_fields.get_fields_from_item(item)
-      item['sourceItemId'] = fields
-
-    template_values['timelineItems'] = timeline_items
-    template = jinja_environment.get_template('templates/index.html')
-    self.response.out.write(template.render(template_values))
+    page_token = self.request.get('pageToken')
+    counters = None
+    if not page_token:
+      counters = counter_index.get_counters(self.userid)
+      if counters is None:
+        # Until the user's counter index is built, list the timeline instead.
+        counter_index.schedule_reconcile(self.userid)
+    if counters is not None:
+      pager = _IndexPager(counters, util.get_num(self.request.get('offset')))
+    else:
+      # Pages of a timeline listing keep following it, so that their "More
+      # counters" links stay consistent.
+      # self.mirror_service is initialized in util.auth_required.
+      pager = _TimelinePager(self.mirror_service, page_token)
+    template_values['timelineItems'] = pager
+    template = templating.get_template('templates/index.html')
+    # Timeline pages are fetched lazily as the template renders. The python27
+    # runtime buffers the whole response, so the page is not sent in chunks.
+    for chunk in template.generate(template_values):
+      self.response.out.write(chunk)
 
   @util.auth_required
   def get(self):
@@ -99,7 +151,9 @@ class MainHandler(webapp2.RequestHandler):
         'newCounter': self._new_counter,
         'deleteCounter': self._delete_counter,
         'resetCounter': self._reset_counter,
-        'updateCounter': self._update_counter
+        'updateCounter': self._update_counter,
+        'bulkNewCounters': self._bulk_new_counters,
+        'bulkAction': self._bulk_action
     }
     if operation in operations:
       message = operations[operation]()
@@ -113,6 +167,8 @@ class MainHandler(webapp2.RequestHandler):
     """Deletes the user-specified timeline item."""
     self.mirror_service.timeline().delete(
         id=self.request.get('itemId')).execute()
+    counter_store.delete(self.request.get('itemId'), self.userid)
+    counter_index.remove_counter(self.userid, self.request.get('itemId'))
     return 'Counter Deleted'
 
 
@@ -125,8 +181,13 @@ class MainHandler(webapp2.RequestHandler):
         'name': self.request.get('name'),
         'num': util.get_num(self.request.get('num'))
     }
-    custom_item_fields.set_multiple(
-        item, new_fields, TIMELINE_ITEM_TEMPLATE_URL)
+    custom_item_fields.FieldView(
+        item, TIMELINE_ITEM_TEMPLATE_URL).update(new_fields).commit()
+    counter_store.set_value(
+        self.request.get('itemId'), new_fields['num'], new_fields['name'])
+    counter_index.put_counter(
+        self.userid, self.request.get('itemId'), new_fields['name'],
+        new_fields['num'])
 
     if 'notification' in item:
       item.pop('notification')
@@ -139,8 +200,11 @@ class MainHandler(webapp2.RequestHandler):
     item = self.mirror_service.timeline().get(
         id=self.request.get('itemId')).execute()
 
-    item = custom_item_fields.set(
-        item, 'num', 0, TIMELINE_ITEM_TEMPLATE_URL)
+    fields = custom_item_fields.FieldView(item, TIMELINE_ITEM_TEMPLATE_URL)
+    item = fields.set('num', 0).commit()
+    counter_store.set_value(self.request.get('itemId'), 0)
+    counter_index.put_counter(
+        self.userid, self.request.get('itemId'), fields.get('name'), 0)
 
     if 'notification' in item:
       item.pop('notification')
@@ -150,10 +214,15 @@ class MainHandler(webapp2.RequestHandler):
 
   def _subscribe(self):
     """Subscribe to timeline notifications if not yet subscribed."""
-    subscriptions = self.mirror_service.subscriptions().list().execute()
-    for subscription in subscriptions.get('items', []):
-      if subscription.get('collection') == 'timeline':
-        return
+    subscribed = registry.is_subscribed(self.userid, 'timeline')
+    if subscribed is None:
+      # Only list subscriptions when the registry does not know the user.
+      subscriptions = self.mirror_service.subscriptions().list().execute()
+      registry.set_from_subscriptions(
+          self.userid, subscriptions.get('items', []))
+      subscribed = registry.is_subscribed(self.userid, 'timeline')
+    if subscribed:
+      return
     logging.info('Subscribing to Timeline')
     # self.userid is initialized in util.auth_required.
     body = {
@@ -163,10 +232,10 @@ class MainHandler(webapp2.RequestHandler):
     }
     # self.mirror_service is initialized in util.auth_required.
     self.mirror_service.subscriptions().insert(body=body).execute()
+    registry.add_collection(self.userid, 'timeline')
 
-  def _new_counter(self):
-    """Insert a timeline item."""
-    logging.info('Inserting timeline item')
+  def _new_counter_body(self, name, num):
+    """Returns the body of a new counter timeline item."""
     # Note that icons will not show up when making counters on a
     # locally hosted web interface.
     body = {
@@ -201,15 +270,32 @@ class MainHandler(webapp2.RequestHandler):
             {'action': 'DELETE'}
         ]
     }
-    new_fields = {
-        'name': self.request.get('name'),
-        'num': util.get_num(self.request.get('num'))
-    }
-    custom_item_fields.set_multiple(
-        body, new_fields, TIMELINE_ITEM_TEMPLATE_URL)
+    return custom_item_fields.set_multiple(
+        body, {'name': name, 'num': num}, TIMELINE_ITEM_TEMPLATE_URL)
+
+  def _store_new_counters(self, items):
+    """Records newly inserted counter timeline items."""
+    counters = []
+    entries = []
+    for item in items:
+      fields = custom_item_fields.FieldView(item)
+      counters.append(
+          (item['id'], self.userid, fields.get('name'), fields.get('num')))
+      entries.append(
+          (item['id'], fields.get('name'), fields.get('num'),
+           item.get('created')))
+    counter_store.create_multi(counters)
+    counter_index.put_counters(self.userid, entries)
+
+  def _new_counter(self):
+    """Insert a timeline item."""
+    logging.info('Inserting timeline item')
+    body = self._new_counter_body(
+        self.request.get('name'), util.get_num(self.request.get('num')))
 
     # self.mirror_service is initialized in util.auth_required.
-    self.mirror_service.timeline().insert(body=body).execute()
+    item = self.mirror_service.timeline().insert(body=body).execute()
+    self._store_new_counters([item])
 
     # Subscribe to timeline notifications if not yet subscribed. A
     # subscription should have been made during initial OAuth grant
@@ -224,6 +310,108 @@ class MainHandler(webapp2.RequestHandler):
       )
     return  'A new counter has been created.'
 
+  def _bulk_new_counters(self):
+    """Insert one timeline item per name/num pair in a single batch."""
+    names = self.request.get_all('name')
+    nums = self.request.get_all('num')
+    logging.info('Inserting %d timeline items', len(names))
+    created = []
+
+    def callback(request_id, response, exception):
+      if exception is None:
+        created.append(response)
+
+    requests = []
+    for name, num in itertools.izip_longest(names, nums, fillvalue=''):
+      body = self._new_counter_body(name, util.get_num(num))
+      requests.append(
+          (self.mirror_service.timeline().insert(body=body), callback))
+    write_behind.execute_batch(requests)
+    self._store_new_counters(created)
+
+    try:
+      self._subscribe()
+    except HttpError:
+      logging.warning('Could not subscribe to timeline notifications.')
+    return '%d counter(s) created, %d failed.' % (
+        len(created), len(requests) - len(created))
+
+  def _bulk_action(self):
+    """Apply an action to the selected counters.
+
+    The action is a menu action of the cards (see coalescer.OPTIONS), or
+    'update' to set the name (if given) and number of the counters. Counters
+    are changed in the counter store, then their timeline cards are patched
+    in a single batch.
+    """
+    action = self.request.get('action')
+    # A counter selected twice is changed once.
+    item_ids = list(collections.OrderedDict.fromkeys(
+        self.request.get_all('itemId')))
+    if action != 'update' and action not in coalescer.OPTIONS:
+      return "I don't know how to " + action
+    owned_ids = self._owned_counters(item_ids)
+
+    for item_id in owned_ids:
+      if action == 'update':
+        counter_store.set_value(
+            item_id, util.get_num(self.request.get('num')),
+            self.request.get('name') or None)
+      else:
+        change = coalescer.CounterChange()
+        change.add(action)
+        counter_store.apply_change(item_id, self.userid, change)
+
+    counters = [
+        counter for counter in counter_store.get_multi(owned_ids)
+        if counter is not None]
+    values = counter_store.get_values(counters)
+    counter_index.put_counters(self.userid, [
+        (counter.key().name(), counter.name, value, None)
+        for counter, value in zip(counters, values)])
+    requests = []
+    for counter, value in zip(counters, values):
+      body = custom_item_fields.set_multiple(
+          {}, {'name': counter.name, 'num': value},
+          TIMELINE_ITEM_TEMPLATE_URL)
+      requests.append((
+          self.mirror_service.timeline().patch(
+              id=counter.key().name(), body=body),
+          None))
+    results = write_behind.execute_batch(requests)
+    return '%d counter(s) updated, %d failed.' % (
+        results.success, len(item_ids) - results.success)
+
+  def _owned_counters(self, item_ids):
+    """Returns the ids of the stored counters of the user among item_ids.
+
+    Counters missing from the counter store are first added from their
+    cards, which are fetched with the credentials of the user and so can
+    only be the user's. Counters of other users are left out.
+    """
+    missing = [
+        item_id for item_id, counter
+        in zip(item_ids, counter_store.get_multi(item_ids))
+        if counter is None]
+
+    seeded = []
+
+    def callback(request_id, response, exception):
+      if exception is None:
+        fields = custom_item_fields.FieldView(response)
+        seeded.append((
+            response['id'], self.userid, fields.get('name'),
+            util.get_num(fields.get('num', 0))))
+
+    write_behind.execute_batch([
+        (self.mirror_service.timeline().get(id=item_id), callback)
+        for item_id in missing])
+    counter_store.create_multi(seeded)
+    return [
+        item_id for item_id, counter
+        in zip(item_ids, counter_store.get_multi(item_ids))
+        if counter is not None and counter.userid == self.userid]
+
 
 MAIN_ROUTES = [
     ('/', MainHandler)
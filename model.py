@@ -27,5 +27,65 @@ class Credentials(db.Model):
 
   The CredentialsProperty is provided by the Google API Python Client, and is
   used by the Storage classes to store OAuth 2.0 credentials in the data store.
+
+  token_expiry mirrors the expiry of the access token so that credentials can
+  be queried in expiry order; it is kept up to date on every put.
   """
   credentials = CredentialsProperty()
+  token_expiry = db.DateTimeProperty()
+
+  def put(self, **kwargs):
+    """Write the entity, indexing the expiry of valid access tokens."""
+    self.token_expiry = None
+    if self.credentials and not self.credentials.invalid:
+      self.token_expiry = getattr(self.credentials, 'token_expiry', None)
+    return db.Model.put(self, **kwargs)
+
+
+class Counter(db.Model):
+  """Datastore entity holding the authoritative value of a counter.
+
+  Entities are keyed by timeline item ID. Increments are not written to this
+  entity but spread over CounterShard entities so that a hot counter is not
+  limited by the write rate of a single entity group. The value of the
+  counter is base plus the counts of the shards of the current generation;
+  setting the value starts a new generation, which voids all shards at once.
+  """
+  userid = db.StringProperty()
+  name = db.StringProperty(indexed=False)
+  base = db.IntegerProperty(default=0, indexed=False)
+  generation = db.IntegerProperty(default=0, indexed=False)
+  num_shards = db.IntegerProperty(default=1, indexed=False)
+
+
+class CounterShard(db.Model):
+  """Datastore entity holding part of the increments of a Counter.
+
+  Entities are keyed by '<item ID>-<shard index>'. A shard whose generation
+  differs from its counter's generation counts as zero.
+  """
+  count = db.IntegerProperty(default=0, indexed=False)
+  generation = db.IntegerProperty(default=0, indexed=False)
+
+
+class CounterIndex(db.Model):
+  """Datastore entity listing the counters of a user.
+
+  Entities are keyed by user ID. counters is a JSON object mapping the
+  timeline item ID of each counter to its name, value, creation time and
+  last change time, so that the main page can be rendered without listing
+  the user's timeline. Removed counters stay marked as removed until the
+  next reconciliation (see counter_index), which sets reconciled.
+  """
+  counters = db.TextProperty(default='{}')
+  reconciled = db.DateTimeProperty()
+
+
+class SubscriptionRegistry(db.Model):
+  """Datastore entity recording the Mirror API subscriptions of a user.
+
+  Entities are keyed by user ID. collections lists the collections the
+  application is subscribed to for the user, as last seen or changed by the
+  application.
+  """
+  collections = db.StringListProperty(indexed=False)
@@ -0,0 +1,125 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-item coalescing of counter actions received as notifications.
+
+When a user rapidly selects a menu item, Mirror sends one notification per
+selection and each one used to read and write the whole timeline item,
+racing with the others. ItemCoalescer folds every action received for an
+item of a user during a short window into a single CounterChange, and only the first
+request of the window (the leader) performs the read-modify-write. The other
+requests wait for its result, so that a failed flush fails all of them and
+each of their actions is retried.
+"""
+
+import threading
+import time
+
+
+# Seconds the leader waits for more actions before flushing an item.
+FLUSH_WINDOW = 0.3
+
+
+DELTAS = {
+    'increment': 1,
+    'decrement': -1
+}
+
+# Counter actions available from the menu of a counter card.
+OPTIONS = frozenset(DELTAS) | frozenset(['reset'])
+
+
+class CounterChange(object):
+  """Net effect of a burst of increment, decrement and reset actions."""
+
+  def __init__(self):
+    """Initialize a new CounterChange that leaves the counter unchanged."""
+    self.reset = False
+    self.delta = 0
+    self.actions = 0
+
+  def add(self, option):
+    """Folds an action ('increment', 'decrement' or 'reset') into the change."""
+    if option == 'reset':
+      # A reset discards the deltas folded before it.
+      self.reset = True
+      self.delta = 0
+    else:
+      self.delta += DELTAS[option]
+    self.actions += 1
+
+
+class _PendingChange(object):
+  """Change waiting for its window to end, and the result of its flush."""
+
+  def __init__(self):
+    self.change = CounterChange()
+    self.done = threading.Event()
+    self.error = None
+
+
+class ItemCoalescer(object):
+  """Folds concurrent counter actions per user and item into one flush."""
+
+  def __init__(self, window=FLUSH_WINDOW):
+    """Initialize a new ItemCoalescer flushing every window seconds."""
+    self._window = window
+    self._pending = {}
+    self._lock = threading.Lock()
+
+  def add(self, userid, item_id, option, flush):
+    """Adds an action of a user for item_id.
+
+    Actions are only folded with actions of the same user for the same item,
+    so that a flush never carries another user's actions. If no change is
+    pending, the caller becomes the leader: it
+    waits for the window to collect the actions of concurrent requests and
+    then calls flush(item_id, change) once. Otherwise the action is folded
+    into the pending change and the call waits for the leader's flush.
+    Either way, an exception raised by flush is raised to every caller whose
+    action it contained.
+
+    Args:
+      userid: ID of the user whose notification carried the action.
+      item_id: ID of the timeline item the action applies to.
+      option: Action to fold ('increment', 'decrement' or 'reset').
+      flush: Callable applying a CounterChange to the item.
+    Returns:
+      True if this call flushed the item, False if it was coalesced.
+    """
+    key = (userid, item_id)
+    with self._lock:
+      pending = self._pending.get(key)
+      leader = pending is None
+      if leader:
+        pending = self._pending[key] = _PendingChange()
+      pending.change.add(option)
+
+    if not leader:
+      pending.done.wait()
+      if pending.error is not None:
+        raise pending.error
+      return False
+
+    time.sleep(self._window)
+    with self._lock:
+      del self._pending[key]
+    try:
+      flush(item_id, pending.change)
+    except Exception, e:
+      pending.error = e
+      raise
+    finally:
+      pending.done.set()
+    return True
@@ -0,0 +1,56 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recognizes retries of a notification that was already applied.
+
+Mirror notifications carry no delivery ID, and repeated selections of the
+same menu item produce identical notifications, so notifications themselves
+cannot be deduplicated without dropping real user actions. Duplicates come
+from retries of the queued work instead: the notify task queue (see
+notify.work_queue) retries a task whose handler failed after its change had
+been committed, e.g. while scheduling the card projection. Each queued
+notification therefore has a delivery ID, the task name, which only its
+retries repeat; it is recorded as soon as the change is committed.
+"""
+
+from google.appengine.api import memcache
+
+from lru_cache import LRUCache
+
+
+# Seconds during which an applied delivery is recognized. This is longer than
+# the task_age_limit of the notify queue in queue.yaml.
+DEDUPE_WINDOW = 2 * 60 * 60
+
+MEMCACHE_NAMESPACE = 'notifications'
+
+# Deliveries applied by this instance, checked before memcache.
+LOCAL_CACHE = LRUCache(10000, ttl=DEDUPE_WINDOW)
+
+
+def is_duplicate(delivery_id):
+  """Returns whether the delivery with this ID was already applied."""
+  if delivery_id in LOCAL_CACHE:
+    return True
+  if memcache.get(delivery_id, namespace=MEMCACHE_NAMESPACE):
+    LOCAL_CACHE.set(delivery_id, True)
+    return True
+  return False
+
+
+def record(delivery_id):
+  """Records that the change of a delivery has been committed."""
+  LOCAL_CACHE.set(delivery_id, True)
+  memcache.set(
+      delivery_id, 1, time=DEDUPE_WINDOW, namespace=MEMCACHE_NAMESPACE)
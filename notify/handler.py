@@ -21,36 +21,51 @@ import json
 import logging
 import webapp2
 
-from oauth2client.appengine import StorageByKeyName
+from apiclient.http import HttpError
 
-from model import Credentials
+import counter_index
+import counter_store
+import credentials_cache
 import custom_item_fields
-from main_handler import TIMELINE_ITEM_TEMPLATE_URL
+from notify import coalescer
+from notify import dedupe
+from notify import work_queue
 import util
 
 
-PROCESS_OPTIONS = {
-    'increment': lambda num: num + 1,
-    'decrement': lambda num: num - 1,
-    'reset': lambda num: 0
-}
+# Shared by all requests of the instance so that concurrent notifications for
+# the same item are folded together.
+ITEM_COALESCER = coalescer.ItemCoalescer()
 
 
-class NotifyHandler(webapp2.RequestHandler):
-  """Request Handler for notification pings."""
+class NotificationProcessor(object):
+  """Applies a notification to the counters of its user."""
 
-  def post(self):
-    """Handles notification pings."""
-    logging.info('Got a notification with payload %s', self.request.body)
-    data = json.loads(self.request.body)
-    userid = data['userToken']
+  def __init__(self, data, delivery_id):
+    """Initialize a new NotificationProcessor for a parsed notification."""
+    self.data = data
+    self.delivery_id = delivery_id
+    self.userid = data['userToken']
     # TODO: Check that the userToken is a valid userToken.
     self.mirror_service = util.create_service(
         'mirror', 'v1',
-        StorageByKeyName(Credentials, userid, 'credentials').get())
-    if data.get('collection') == 'timeline':
-      self._handle_timeline_notification(data)
+        credentials_cache.get_storage(self.userid).get())
 
+  def process(self):
+    """Handles the notification."""
+    if self.data.get('collection') == 'timeline':
+      if self.data.get('operation') == 'DELETE':
+        self._handle_timeline_deletion(self.data)
+      else:
+        self._handle_timeline_notification(self.data)
+
+  def _handle_timeline_deletion(self, data):
+    """Handle a timeline item deleted from Glass."""
+    if not counter_store.delete(data['itemId'], self.userid):
+      logging.info(
+          'Item %s is not a counter of user %s', data['itemId'], self.userid)
+      return
+    counter_index.remove_counter(self.userid, data['itemId'])
 
   def _handle_timeline_notification(self, data):
     """Handle timeline notification.
@@ -58,30 +73,83 @@ class NotifyHandler(webapp2.RequestHandler):
     This method handles when a user chooses to perform a custom menu optio
     (increment, decrement, reset).
     """
-    # TODO: Race conditions occur if a user rapidly selects a menu item many
-    #       times (concurrently reading and writing the same timeline item).
-    #       Resolve this issue
+    # Rapid selections of a menu item arrive as concurrent notifications:
+    # ITEM_COALESCER folds them so that the item is read and written once.
     for user_action in data.get('userActions', []):
       logging.info(user_action)
       option = user_action.get('payload')
-      if user_action.get('type') == 'CUSTOM' and option in PROCESS_OPTIONS:
-        data = json.loads(self.request.body)
-        item = self.mirror_service.timeline().get(id=data['itemId']).execute()
-        num = util.get_num(custom_item_fields.get(item, 'num'))
-        # possible actions are functions listed in PROCESS_OPTIONS
-        custom_item_fields.set(
-            item, 'num',
-            PROCESS_OPTIONS[option](num), TIMELINE_ITEM_TEMPLATE_URL)
-        if 'notification' in item:
-          item.pop('notification')
-        self.mirror_service.timeline().update(
-            id=data['itemId'], body=item).execute()
-	# Only handle the first successful action.
+      if user_action.get('type') == 'CUSTOM' and option in coalescer.OPTIONS:
+        ITEM_COALESCER.add(
+            self.userid, data['itemId'], option, self._apply_change)
+        # The change is committed: a retry of this delivery must not apply it
+        # again, even if scheduling the projection fails.
+        dedupe.record(self.delivery_id)
+        counter_store.schedule_projection(data['itemId'])
+        # Only handle the first successful action.
         break
       else:
         logging.info(
             "I don't know what to do with this notification: %s", user_action)
 
+  def _apply_change(self, item_id, change):
+    """Apply a coalesced CounterChange to the stored counter.
+
+    The timeline card is updated asynchronously from the counter store.
+    /notify is not authenticated, so only counters of the notification's
+    user are changed.
+    """
+    logging.info(
+        'Applying %d coalesced action(s) to item %s', change.actions, item_id)
+    if counter_store.get(item_id) is None:
+      # Counters created before the counter store existed are seeded from
+      # their timeline card, which can only be read with the credentials of
+      # its owner.
+      try:
+        item = self.mirror_service.timeline().get(id=item_id).execute()
+      except HttpError, e:
+        if e.resp.status != 404:
+          raise
+        logging.info('Item %s is not a card of user %s', item_id, self.userid)
+        return
+      fields = custom_item_fields.FieldView(item)
+      counter_store.create(
+          item_id, self.userid, fields.get('name'),
+          util.get_num(fields.get('num', 0)))
+    counter_store.apply_change(item_id, self.userid, change)
+
+
+def process_notification(payload, delivery_id):
+  """Processes a notification payload taken from the notification queue.
+
+  Args:
+    payload: JSON body of the notification.
+    delivery_id: ID of this delivery, repeated only by its retries.
+  """
+  if dedupe.is_duplicate(delivery_id):
+    logging.info('Ignoring retry of applied delivery %s', delivery_id)
+    return
+  NotificationProcessor(json.loads(payload), delivery_id).process()
+
+
+# Notifications are acknowledged right away and processed from this queue.
+NOTIFICATION_QUEUE = work_queue.create_backend(process_notification)
+
+
+class NotifyHandler(webapp2.RequestHandler):
+  """Request Handler for notification pings."""
+
+  def post(self):
+    """Queues notification pings and acknowledges them."""
+    logging.info('Got a notification with payload %s', self.request.body)
+    try:
+      data = json.loads(self.request.body)
+    except ValueError:
+      data = None
+    if not isinstance(data, dict) or 'userToken' not in data:
+      logging.error('Invalid notification payload')
+      self.abort(400)
+    NOTIFICATION_QUEUE.enqueue(self.request.body)
+
 
 NOTIFY_ROUTES = [
     ('/notify', NotifyHandler)
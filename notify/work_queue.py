@@ -0,0 +1,113 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Queue of notifications acknowledged by /notify and processed later.
+
+Two backends are available, selected by the NOTIFY_QUEUE_BACKEND environment
+variable (see env_variables in app.yaml):
+
+  taskqueue: (default) each notification becomes a task of the 'notify' push
+    queue, whose concurrency is bounded in queue.yaml. Failed notifications
+    are retried by the task queue.
+  local: notifications are processed by a bounded pool of threads of the
+    instance that received them. Threads cannot outlive requests on
+    automatically scaled instances, so this is meant for the development
+    server and load tests.
+"""
+
+import logging
+import os
+import Queue
+import threading
+import uuid
+
+from google.appengine.api import taskqueue
+
+
+PROCESS_URL = '/tasks/process_notification'
+
+QUEUE_NAME = 'notify'
+
+# Number of notifications processed concurrently by the local backend.
+MAX_WORKERS = 10
+
+
+class TaskQueueBackend(object):
+  """Queues notifications as push queue tasks."""
+
+  def enqueue(self, payload):
+    """Adds a notification payload to the queue."""
+    taskqueue.add(url=PROCESS_URL, queue_name=QUEUE_NAME, payload=payload)
+
+
+class LocalBackend(object):
+  """Processes notifications on a bounded pool of in-process threads."""
+
+  def __init__(self, process, max_workers=MAX_WORKERS):
+    """Initialize a new LocalBackend.
+
+    Args:
+      process: Callable processing a notification payload, of the form
+        process(payload, delivery_id).
+      max_workers: Number of notifications processed concurrently.
+    """
+    self._process = process
+    self._max_workers = max_workers
+    self._queue = Queue.Queue()
+    self._workers = []
+    self._lock = threading.Lock()
+
+  def enqueue(self, payload):
+    """Adds a notification payload to the queue."""
+    self._start_workers()
+    self._queue.put((payload, uuid.uuid4().hex))
+
+  def join(self):
+    """Waits until all the queued notifications have been processed."""
+    self._queue.join()
+
+  def _start_workers(self):
+    """Starts the worker threads on first use."""
+    with self._lock:
+      while len(self._workers) < self._max_workers:
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True
+        worker.start()
+        self._workers.append(worker)
+
+  def _work(self):
+    """Processes queued notifications forever."""
+    while True:
+      payload, delivery_id = self._queue.get()
+      try:
+        self._process(payload, delivery_id)
+      except Exception:
+        logging.exception('Failed to process notification %s', payload)
+      finally:
+        self._queue.task_done()
+
+
+def create_backend(process):
+  """Returns the backend configured by NOTIFY_QUEUE_BACKEND.
+
+  Args:
+    process: Callable of the form process(payload, delivery_id), used by
+      backends that process notifications in-process.
+  """
+  backend = os.environ.get('NOTIFY_QUEUE_BACKEND', 'taskqueue')
+  if backend == 'local':
+    return LocalBackend(process)
+  if backend != 'taskqueue':
+    logging.warning('Unknown notification queue backend %s', backend)
+  return TaskQueueBackend()
@@ -17,33 +17,58 @@
 __author__ = 'alainv@google.com (Alain Vongsouvanh)'
 
 
+import copy
 import logging
+import threading
 import webapp2
-from urlparse import urlparse
 
-from oauth2client.appengine import StorageByKeyName
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.client import FlowExchangeError
 
-from model import Credentials
+import credentials_cache
+from subscription import registry
 import util
 
 
 SCOPES = ('https://www.googleapis.com/auth/glass.timeline '
           'https://www.googleapis.com/auth/userinfo.profile')
 
+CLIENT_SECRETS_FILE = 'client_secrets.json'
+
+
+_flow_template = None
+_flow_template_lock = threading.Lock()
+
+
+def _get_flow_template():
+  """Returns the OAuth 2.0 flow built from the client secrets, once per process.
+
+  Reading and validating client_secrets.json on every /auth and
+  /oauth2callback request is wasted work: the file only changes with a new
+  deployment.
+  """
+  global _flow_template
+  if _flow_template is None:
+    with _flow_template_lock:
+      if _flow_template is None:
+        _flow_template = flow_from_clientsecrets(
+            CLIENT_SECRETS_FILE, scope=SCOPES)
+  return _flow_template
+
 
 class OAuthBaseRequestHandler(webapp2.RequestHandler):
   """Base request handler for OAuth 2.0 flow."""
 
   def create_oauth_flow(self):
     """Create OAuth2.0 flow controller."""
-    flow = flow_from_clientsecrets('client_secrets.json', scope=SCOPES)
+    # Each request gets its own shallow copy of the template; params is the
+    # only mutable attribute that handlers change.
+    flow = copy.copy(_get_flow_template())
+    flow.params = dict(flow.params)
     # Dynamically set the redirect_uri based on the request URL. This is
     # extremely convenient for debugging to an alternative host without manually
     # setting the redirect URI.
-    pr = urlparse(self.request.url)
-    flow.redirect_uri = '%s://%s/oauth2callback' % (pr.scheme, pr.netloc)
+    flow.redirect_uri = util.get_full_url(self, '/oauth2callback')
     return flow
 
 
@@ -87,7 +112,7 @@ class OAuthCodeExchangeHandler(OAuthBaseRequestHandler):
 
     # Store the credentials in the data store using the userid as the key.
     # TODO: Hash the userid the same way the userToken is.
-    StorageByKeyName(Credentials, userid, 'credentials').put(creds)
+    credentials_cache.get_storage(userid).put(creds)
     logging.info('Successfully stored credentials for user: %s', userid)
     util.store_userid(self, userid)
 
@@ -116,6 +141,7 @@ class OAuthCodeExchangeHandler(OAuthBaseRequestHandler):
           'callbackUrl': util.get_full_url(self, '/notify')
       }
       mirror_service.subscriptions().insert(body=subscription_body).execute()
+      registry.add_collection(userid, 'timeline')
     else:
       logging.info('Post auth tasks are not supported on staging.')
 
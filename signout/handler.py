@@ -21,7 +21,7 @@ import webapp2
 
 from google.appengine.api import urlfetch
 
-from model import Credentials
+import credentials_cache
 import util
 
 
@@ -36,9 +36,8 @@ class SignoutHandler(webapp2.RequestHandler):
     """Delete the user's credentials from the datastore."""
     urlfetch.fetch(OAUTH2_REVOKE_ENDPOINT % self.credentials.refresh_token)
     util.store_userid(self, '')
-    credentials_entity = Credentials.get_by_key_name(self.userid)
-    if credentials_entity:
-      credentials_entity.delete()
+    # Deleting through the storage also invalidates the cached credentials.
+    credentials_cache.get_storage(self.userid).delete()
     self.redirect('/')
 
 
@@ -0,0 +1,188 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process registry of request and operation latencies.
+
+Each thread records into its own set of metrics, so recording never takes a
+lock; snapshot() adds up the metrics of all threads. A timer counts its
+events and keeps their total and maximum duration and a histogram over
+BUCKETS; a counter keeps a running total.
+
+App Engine API calls (memcache, datastore, task queue...) are recorded by
+install_rpc_hooks() under 'rpc:<service>.<call>'; other operations use
+timed() and requests are recorded by route in main.py. The registry can be
+viewed as JSON at /debug/stats.
+"""
+
+import functools
+import threading
+import time
+
+
+# Upper bounds, in milliseconds, of the latency histogram buckets.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class _Counter(object):
+  """Running total of one quantity in one thread."""
+
+  def __init__(self):
+    self.total = 0
+
+
+class _Metric(object):
+  """Count, durations and histogram of one operation in one thread."""
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.buckets = [0] * (len(BUCKETS) + 1)
+
+  def record(self, seconds):
+    milliseconds = seconds * 1000
+    self.count += 1
+    self.total += milliseconds
+    self.max = max(self.max, milliseconds)
+    for index, bound in enumerate(BUCKETS):
+      if milliseconds <= bound:
+        break
+    else:
+      index = len(BUCKETS)
+    self.buckets[index] += 1
+
+
+_local = threading.local()
+
+# Metrics of every thread that recorded something, appended to once per
+# thread.
+_thread_metrics = []
+
+
+def _metrics():
+  """Returns the metrics of the current thread."""
+  metrics = getattr(_local, 'metrics', None)
+  if metrics is None:
+    metrics = _local.metrics = {}
+    _thread_metrics.append(metrics)
+  return metrics
+
+
+def record(name, seconds):
+  """Records an operation that took the given number of seconds."""
+  metrics = _metrics()
+  metric = metrics.get(name)
+  if metric is None:
+    metric = metrics[name] = _Metric()
+  metric.record(seconds)
+
+
+def increment(name, amount=1):
+  """Adds amount to a counter."""
+  metrics = _metrics()
+  counter = metrics.get(name)
+  if counter is None:
+    counter = metrics[name] = _Counter()
+  counter.total += amount
+
+
+class timed(object):
+  """Records the duration of a block or of each call of a function.
+
+  Use as `with stats.timed('name'):` or as a `@stats.timed('name')`
+  decorator.
+  """
+
+  def __init__(self, name):
+    self._name = name
+    self._start = None
+
+  def __enter__(self):
+    self._start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    record(self._name, time.time() - self._start)
+
+  def __call__(self, function):
+    name = self._name
+
+    @functools.wraps(function)
+    def timed_function(*args, **kwargs):
+      start = time.time()
+      try:
+        return function(*args, **kwargs)
+      finally:
+        record(name, time.time() - start)
+    return timed_function
+
+
+def snapshot():
+  """Returns all metrics, added up across threads, as a JSON-ready dict."""
+  totals = {}
+  for metrics in list(_thread_metrics):
+    for name, metric in metrics.items():
+      total = totals.get(name)
+      if total is None:
+        total = totals[name] = type(metric)()
+      if isinstance(metric, _Counter):
+        total.total += metric.total
+        continue
+      total.count += metric.count
+      total.total += metric.total
+      total.max = max(total.max, metric.max)
+      total.buckets = [a + b for a, b in zip(total.buckets, metric.buckets)]
+
+  result = {}
+  for name, metric in totals.iteritems():
+    if isinstance(metric, _Counter):
+      result[name] = {'total': metric.total}
+      continue
+    if not metric.count:
+      continue
+    bounds = [str(bound) for bound in BUCKETS] + ['inf']
+    result[name] = {
+        'count': metric.count,
+        'total_ms': metric.total,
+        'mean_ms': metric.total / metric.count,
+        'max_ms': metric.max,
+        'histogram_ms': dict(zip(bounds, metric.buckets))
+    }
+  return result
+
+
+def reset():
+  """Clears the metrics of all threads."""
+  for metrics in list(_thread_metrics):
+    metrics.clear()
+
+
+def install_rpc_hooks():
+  """Records the duration of every App Engine API call."""
+  from google.appengine.api import apiproxy_stub_map
+
+  starts = {}
+
+  def pre_call(service, call, request, response, rpc):
+    starts[id(rpc)] = time.time()
+
+  def post_call(service, call, request, response, rpc, error):
+    start = starts.pop(id(rpc), None)
+    if start is not None:
+      record('rpc:%s.%s' % (service, call), time.time() - start)
+
+  apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+      'stats', pre_call)
+  apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+      'stats', post_call)
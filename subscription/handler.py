@@ -17,19 +17,16 @@
 __author__ = 'jenniferwang@google.com (Jennifer Wang)'
 
 
-import jinja2
 import logging
-import os
 import webapp2
 
 from apiclient.http import HttpError
 from google.appengine.api import memcache
 
+from subscription import registry
+import templating
 import util
-
-
-jinja_environment = jinja2.Environment(loader=jinja2.FileSystemLoader(
-    os.path.dirname(os.path.dirname((__file__)))))
+import write_behind
 
 
 class SubscriptionHandler(webapp2.RequestHandler):
@@ -44,9 +41,12 @@ class SubscriptionHandler(webapp2.RequestHandler):
 
     template_values['subscriptions'] = (
         self.mirror_service.subscriptions().list().execute().get('items', []))
+    # Keep the registry in sync with what the user is shown.
+    registry.set_from_subscriptions(
+        self.userid, template_values['subscriptions'])
     template_values['subscriptionUrl'] = util.get_full_url(self, '/notify')
 
-    template = jinja_environment.get_template('templates/subscription.html')
+    template = templating.get_template('templates/subscription.html')
     self.response.out.write(template.render(template_values))
 
   @util.auth_required
@@ -75,11 +75,33 @@ class SubscriptionHandler(webapp2.RequestHandler):
     self.redirect('/subscription')
 
   def _clear_subscriptions(self):
-    """Unsubscribe from notifications."""
-    subscriptions = self.mirror_service.subscriptions().list().execute()
-    for subscription in subscriptions.get('items', []):
-      self.mirror_service.subscriptions().delete(
-          id=subscription.get('id')).execute()
+    """Unsubscribe from notifications.
+
+    All subscriptions are deleted with a single batch request.
+    """
+    subscriptions = self.mirror_service.subscriptions().list().execute().get(
+        'items', [])
+    failed = []
+
+    def make_callback(subscription):
+      def callback(request_id, response, exception):
+        if exception is not None:
+          failed.append(subscription)
+      return callback
+
+    requests = []
+    for subscription in subscriptions:
+      requests.append((
+          self.mirror_service.subscriptions().delete(id=subscription.get('id')),
+          make_callback(subscription)))
+    if requests:
+      write_behind.execute_batch(requests)
+    registry.set_from_subscriptions(self.userid, failed)
+
+    if failed:
+      return '%d subscription(s) deleted, %d failed: %s' % (
+          len(subscriptions) - len(failed), len(failed),
+          ', '.join(subscription.get('id') for subscription in failed))
     return 'Application has been unsubscribed.'
 
   def _make_subscription(self):
@@ -95,6 +117,7 @@ class SubscriptionHandler(webapp2.RequestHandler):
 
     try:
       self.mirror_service.subscriptions().insert(body=body).execute()
+      registry.add_collection(self.userid, 'timeline')
     except HttpError:
       return (
           'notifications were not enabled because an HTTP Error occured. '
@@ -0,0 +1,65 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-user registry of subscriptions, cached in memcache and the datastore.
+
+Handlers that create, list or delete subscriptions record the result here so
+that checking whether a user is subscribed does not need a
+subscriptions().list() call.
+"""
+
+from google.appengine.api import memcache
+
+from model import SubscriptionRegistry
+
+
+MEMCACHE_NAMESPACE = 'subscriptions'
+
+
+def get_collections(userid):
+  """Returns the collections a user is subscribed to, or None if unknown."""
+  collections = memcache.get(userid, namespace=MEMCACHE_NAMESPACE)
+  if collections is None:
+    registry = SubscriptionRegistry.get_by_key_name(userid)
+    if registry is None:
+      return None
+    collections = registry.collections
+    memcache.set(userid, collections, namespace=MEMCACHE_NAMESPACE)
+  return collections
+
+
+def is_subscribed(userid, collection):
+  """Returns whether a user is subscribed to collection, or None if unknown."""
+  collections = get_collections(userid)
+  if collections is None:
+    return None
+  return collection in collections
+
+
+def set_collections(userid, collections):
+  """Records the complete list of collections a user is subscribed to."""
+  collections = sorted(frozenset(collections))
+  SubscriptionRegistry(key_name=userid, collections=collections).put()
+  memcache.set(userid, collections, namespace=MEMCACHE_NAMESPACE)
+
+
+def set_from_subscriptions(userid, subscriptions):
+  """Records the collections of a subscriptions().list() result."""
+  set_collections(
+      userid, [subscription.get('collection') for subscription in subscriptions])
+
+
+def add_collection(userid, collection):
+  """Records a new subscription of a user to collection."""
+  set_collections(userid, (get_collections(userid) or []) + [collection])
@@ -0,0 +1,160 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Request Handlers for /tasks endpoints, called by the task queue and cron."""
+
+
+import datetime
+import logging
+import webapp2
+
+from apiclient.http import HttpError
+from google.appengine.api import taskqueue
+from oauth2client.client import AccessTokenRefreshError
+
+import counter_index
+import counter_store
+import credentials_cache
+import custom_item_fields
+from main_handler import TIMELINE_ITEM_TEMPLATE_URL
+from notify import work_queue
+from notify.handler import process_notification
+import token_refresh
+import util
+import write_behind
+
+
+REFRESH_TOKENS_URL = '/tasks/refresh_tokens'
+
+# Format of the scan start time passed between token refresh tasks.
+SCAN_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+RECONCILE_INDEXES_URL = '/tasks/reconcile_indexes'
+
+
+class ProjectCounterHandler(webapp2.RequestHandler):
+  """Request Handler updating a timeline card from the counter store."""
+
+  def post(self):
+    """Write the stored value of a counter on its timeline card."""
+    item_id = self.request.get('itemId')
+    counter_store.clear_projection(item_id)
+    counter = counter_store.get(item_id)
+    if counter is None:
+      logging.info('Counter %s no longer exists', item_id)
+      return
+    # The counter's owner, not whoever triggered the projection, owns the
+    # card and the index entry.
+    userid = counter.userid
+    value = counter_store.get_value(counter)
+    counter_index.put_counter(userid, item_id, counter.name, value)
+    credentials = credentials_cache.get_storage(userid).get()
+    if credentials is None:
+      logging.info('User %s no longer has credentials', userid)
+      return
+    mirror_service = util.create_service('mirror', 'v1', credentials)
+    # The card only holds the counter's custom fields and their rendering, so
+    # a patch is enough and the item does not need to be read first.
+    body = custom_item_fields.set_multiple(
+        {},
+        {'name': counter.name, 'num': value},
+        TIMELINE_ITEM_TEMPLATE_URL)
+
+    def callback(request_id, response, exception):
+      if exception is None:
+        return
+      if isinstance(exception, HttpError) and exception.resp.status == 404:
+        logging.info('Card of counter %s no longer exists', item_id)
+      elif isinstance(exception, AccessTokenRefreshError):
+        logging.info('Credentials of user %s were revoked', userid)
+      else:
+        counter_store.schedule_projection(item_id)
+
+    write_behind.TIMELINE_WRITER.add(
+        mirror_service.timeline().patch(id=item_id, body=body),
+        callback=callback)
+
+
+class ProcessNotificationHandler(webapp2.RequestHandler):
+  """Request Handler processing a notification acknowledged by /notify."""
+
+  def post(self):
+    """Process a queued notification; failures are retried by the queue."""
+    # The task name identifies the delivery across the retries of the task.
+    process_notification(
+        self.request.body, self.request.headers['X-AppEngine-TaskName'])
+
+
+class RefreshTokensHandler(webapp2.RequestHandler):
+  """Request Handler refreshing access tokens that are about to expire."""
+
+  def get(self):
+    """Refresh a batch of tokens, called by cron."""
+    self._refresh(datetime.datetime.utcnow(), None)
+
+  def post(self):
+    """Refresh a batch of tokens, continuing a previous batch."""
+    self._refresh(
+        datetime.datetime.strptime(self.request.get('now'), SCAN_TIME_FORMAT),
+        self.request.get('cursor'))
+
+  def _refresh(self, now, cursor):
+    """Refresh a batch of tokens and chain a task for the next batch."""
+    cursor = token_refresh.refresh_expiring(now, cursor)
+    if cursor:
+      taskqueue.add(url=REFRESH_TOKENS_URL, params={
+          'now': now.strftime(SCAN_TIME_FORMAT),
+          'cursor': cursor
+      })
+
+
+class ReconcileIndexHandler(webapp2.RequestHandler):
+  """Request Handler rebuilding a user's counter index from the timeline."""
+
+  def post(self):
+    """Reconcile the counter index of a user."""
+    userid = self.request.get('userid')
+    credentials = credentials_cache.get_storage(userid).get()
+    if credentials is None:
+      logging.info('User %s has signed out', userid)
+      return
+    counter_index.reconcile(
+        userid, util.create_service('mirror', 'v1', credentials))
+
+
+class ReconcileIndexesHandler(webapp2.RequestHandler):
+  """Request Handler scheduling the reconciliation of all counter indexes."""
+
+  def get(self):
+    """Schedule a batch of reconciliations, called by cron."""
+    self._schedule(None)
+
+  def post(self):
+    """Schedule a batch of reconciliations, continuing a previous batch."""
+    self._schedule(self.request.get('cursor'))
+
+  def _schedule(self, cursor):
+    """Schedule a batch of reconciliations and chain the next batch."""
+    cursor = counter_index.schedule_reconcile_batch(cursor)
+    if cursor:
+      taskqueue.add(url=RECONCILE_INDEXES_URL, params={'cursor': cursor})
+
+
+TASK_ROUTES = [
+    (counter_store.PROJECTION_URL, ProjectCounterHandler),
+    (work_queue.PROCESS_URL, ProcessNotificationHandler),
+    (REFRESH_TOKENS_URL, RefreshTokensHandler),
+    (counter_index.RECONCILE_URL, ReconcileIndexHandler),
+    (RECONCILE_INDEXES_URL, ReconcileIndexesHandler)
+]
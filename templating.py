@@ -0,0 +1,156 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shared Jinja environment for all templates of the application.
+
+In production, templates are loaded from modules precompiled at deploy time
+(run `python templating.py` before `appcfg.py update`), templates are never
+checked for changes on disk, and templates that were not precompiled are
+compiled once and kept in a memcache bytecode cache shared by instances.
+Locally, templates are loaded from disk and reloaded when they change.
+
+Precompiled modules are only used if the manifest written next to them
+matches the Jinja2 version of the runtime and the hash of every template
+source: otherwise a stale deploy would serve outdated templates, or modules
+compiled by another Jinja2 version would fail at run time.
+
+Run as a script, this module precompiles the templates in templates/.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import jinja2
+
+import stats
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COMPILED_TEMPLATES_DIR = os.path.join(ROOT_DIR, 'compiled_templates')
+
+TEMPLATES_DIR = 'templates'
+
+# Written by compile_templates() next to the compiled modules.
+MANIFEST_PATH = os.path.join(COMPILED_TEMPLATES_DIR, 'manifest.json')
+
+PRODUCTION = os.environ.get(
+    'SERVER_SOFTWARE', '').startswith('Google App Engine')
+
+
+class _TimedTemplate(jinja2.Template):
+  """Template recording its render time in the stats registry."""
+
+  def render(self, *args, **kwargs):
+    with stats.timed('template:' + self.name):
+      return jinja2.Template.render(self, *args, **kwargs)
+
+  def generate(self, *args, **kwargs):
+    # Includes the time spent by the consumer between chunks, such as
+    # fetching the items that a lazily paginated page lists.
+    with stats.timed('template:' + self.name):
+      for chunk in jinja2.Template.generate(self, *args, **kwargs):
+        yield chunk
+
+
+def _template_names():
+  """Returns the names of the templates in TEMPLATES_DIR."""
+  names = []
+  for directory, _, files in os.walk(os.path.join(ROOT_DIR, TEMPLATES_DIR)):
+    relative = os.path.relpath(directory, ROOT_DIR).replace(os.sep, '/')
+    names.extend(relative + '/' + name for name in files)
+  return names
+
+
+def _source_hash(name):
+  """Returns the SHA-1 hex digest of a template source."""
+  with open(os.path.join(ROOT_DIR, name), 'rb') as source:
+    return hashlib.sha1(source.read()).hexdigest()
+
+
+def _manifest():
+  """Returns the manifest describing the current template sources."""
+  return {
+      'jinja2': jinja2.__version__,
+      'templates': dict(
+          (name, _source_hash(name)) for name in _template_names())
+  }
+
+
+def _compiled_templates_valid():
+  """Returns whether the precompiled templates can be used."""
+  try:
+    with open(MANIFEST_PATH) as manifest_file:
+      manifest = json.load(manifest_file)
+  except (IOError, ValueError):
+    logging.warning('Precompiled templates have no readable manifest')
+    return False
+  if manifest != _manifest():
+    logging.warning(
+        'Precompiled templates do not match the Jinja2 version or the '
+        'template sources; run `python templating.py` before deploying')
+    return False
+  return True
+
+
+def _create_environment():
+  """Returns the Jinja environment for the current runtime."""
+  file_system_loader = jinja2.FileSystemLoader(ROOT_DIR)
+  if not PRODUCTION:
+    environment = jinja2.Environment(
+        loader=file_system_loader, auto_reload=True)
+    environment.template_class = _TimedTemplate
+    return environment
+
+  from google.appengine.api import memcache
+  loader = file_system_loader
+  if os.path.isdir(COMPILED_TEMPLATES_DIR) and _compiled_templates_valid():
+    loader = jinja2.ChoiceLoader([
+        jinja2.ModuleLoader(COMPILED_TEMPLATES_DIR), file_system_loader])
+  environment = jinja2.Environment(
+      loader=loader, auto_reload=False,
+      bytecode_cache=jinja2.MemcachedBytecodeCache(
+          memcache, prefix='jinja2/bytecode/'))
+  environment.template_class = _TimedTemplate
+  return environment
+
+
+jinja_environment = _create_environment()
+
+
+def get_template(name):
+  """Returns the template with the given path relative to the app root."""
+  # Template paths may be written as URLs (e.g. '/templates/card.html') but
+  # precompiled templates are looked up by their exact relative name.
+  return jinja_environment.get_template(name.lstrip('/'))
+
+
+def compile_templates():
+  """Precompiles the templates in templates/ to COMPILED_TEMPLATES_DIR.
+
+  Also writes the manifest checked before the compiled modules are used.
+  """
+  environment = jinja2.Environment(
+      loader=jinja2.FileSystemLoader(ROOT_DIR))
+  environment.compile_templates(
+      COMPILED_TEMPLATES_DIR, zip=None,
+      filter_func=lambda name: name.startswith(TEMPLATES_DIR + '/'))
+  with open(MANIFEST_PATH, 'w') as manifest_file:
+    json.dump(_manifest(), manifest_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  compile_templates()
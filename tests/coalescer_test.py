@@ -0,0 +1,124 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for notify.coalescer."""
+
+import threading
+import time
+import unittest
+
+from notify import coalescer
+
+
+class CounterChangeTest(unittest.TestCase):
+
+  def _change(self, *options):
+    change = coalescer.CounterChange()
+    for option in options:
+      change.add(option)
+    return change
+
+  def test_folds_deltas(self):
+    change = self._change('increment', 'increment', 'decrement')
+    self.assertFalse(change.reset)
+    self.assertEqual(1, change.delta)
+    self.assertEqual(3, change.actions)
+
+  def test_reset_discards_earlier_deltas(self):
+    change = self._change('increment', 'increment', 'reset')
+    self.assertTrue(change.reset)
+    self.assertEqual(0, change.delta)
+    self.assertEqual(3, change.actions)
+
+  def test_deltas_after_reset_are_kept(self):
+    change = self._change('increment', 'reset', 'decrement', 'decrement')
+    self.assertTrue(change.reset)
+    self.assertEqual(-2, change.delta)
+
+
+class ItemCoalescerTest(unittest.TestCase):
+
+  def setUp(self):
+    self.coalescer = coalescer.ItemCoalescer(window=0.2)
+    self.flushes = []
+    self.results = []
+    self.threads = []
+
+  def _flush(self, item_id, change):
+    self.flushes.append((item_id, change.delta, change.actions))
+
+  def _failing_flush(self, item_id, change):
+    self.flushes.append((item_id, change.delta, change.actions))
+    raise ValueError('flush failed')
+
+  def _add(self, userid, item_id, option, flush):
+    """Adds an action from a new thread, recording its result."""
+
+    def add():
+      try:
+        self.results.append(
+            self.coalescer.add(userid, item_id, option, flush))
+      except ValueError, e:
+        self.results.append(e)
+    thread = threading.Thread(target=add)
+    thread.start()
+    self.threads.append(thread)
+
+  def _add_leader(self, userid, item_id, option, flush):
+    """Adds an action and waits until it is pending as a leader."""
+    self._add(userid, item_id, option, flush)
+    deadline = time.time() + 1
+    while (userid, item_id) not in self.coalescer._pending:
+      self.assertLess(time.time(), deadline)
+      time.sleep(0.001)
+
+  def _join(self):
+    for thread in self.threads:
+      thread.join()
+
+  def test_folds_concurrent_actions_into_one_flush(self):
+    self._add_leader('user', 'item', 'increment', self._flush)
+    self._add('user', 'item', 'increment', self._flush)
+    self._add('user', 'item', 'decrement', self._flush)
+    self._join()
+    self.assertEqual([('item', 1, 3)], self.flushes)
+    self.assertEqual([True, False, False], sorted(self.results, reverse=True))
+
+  def test_does_not_fold_actions_of_other_users(self):
+    self._add_leader('user', 'item', 'increment', self._flush)
+    self._add_leader('other', 'item', 'increment', self._flush)
+    self._join()
+    self.assertEqual([('item', 1, 1), ('item', 1, 1)], self.flushes)
+    self.assertEqual([True, True], self.results)
+
+  def test_flush_error_is_raised_to_every_caller(self):
+    self._add_leader('user', 'item', 'increment', self._failing_flush)
+    self._add('user', 'item', 'increment', self._failing_flush)
+    self._add('user', 'item', 'reset', self._failing_flush)
+    self._join()
+    self.assertEqual(1, len(self.flushes))
+    self.assertEqual(3, len(self.results))
+    for result in self.results:
+      self.assertIsInstance(result, ValueError)
+
+  def test_flushes_again_after_a_failed_flush(self):
+    self._add_leader('user', 'item', 'increment', self._failing_flush)
+    self._join()
+    self.assertTrue(self.coalescer.add('user', 'item', 'reset', self._flush))
+    self.assertEqual(('item', 0, 1), self.flushes[-1])
+
+
+if __name__ == '__main__':
+  unittest.main()
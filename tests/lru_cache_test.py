@@ -0,0 +1,89 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for lru_cache."""
+
+import unittest
+
+import lru_cache
+
+
+class _FakeTime(object):
+  """Replaces the time module of lru_cache with a settable clock."""
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def time(self):
+    return self.now
+
+
+class LRUCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = _FakeTime()
+    self._time = lru_cache.time
+    lru_cache.time = self.clock
+
+  def tearDown(self):
+    lru_cache.time = self._time
+
+  def test_evicts_least_recently_used_entry(self):
+    cache = lru_cache.LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # Reading 'a' makes 'b' the least recently used entry.
+    self.assertEqual(1, cache.get('a'))
+    cache.set('c', 3)
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(1, cache.get('a'))
+    self.assertEqual(3, cache.get('c'))
+    self.assertEqual(2, len(cache))
+
+  def test_set_replaces_existing_entry(self):
+    cache = lru_cache.LRUCache(2)
+    cache.set('a', 1)
+    cache.set('a', 2)
+    self.assertEqual(2, cache.get('a'))
+    self.assertEqual(1, len(cache))
+
+  def test_entries_expire_after_ttl(self):
+    cache = lru_cache.LRUCache(2, ttl=10)
+    cache.set('a', 1)
+    self.clock.now += 9
+    self.assertEqual(1, cache.get('a'))
+    self.assertIn('a', cache)
+    self.clock.now += 2
+    self.assertEqual('default', cache.get('a', 'default'))
+    self.assertNotIn('a', cache)
+
+  def test_counts_hits_and_misses(self):
+    cache = lru_cache.LRUCache(2)
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('b')
+    self.assertIn('a', cache)
+    self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+  def test_delete(self):
+    cache = lru_cache.LRUCache(2)
+    cache.set('a', 1)
+    cache.delete('a')
+    cache.delete('missing')
+    self.assertIsNone(cache.get('a'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,156 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for write_behind."""
+
+import logging
+import threading
+import time
+import unittest
+
+import write_behind
+
+
+class _FakeService(object):
+  batch_uri = 'https://www.googleapis.com/batch'
+
+
+class _FakeBatch(object):
+  """Batch request answering its parts in order.
+
+  A part whose request is 'down' makes the whole batch request fail, as a
+  connection error would, before it and the following parts are answered.
+  """
+
+  executed = []
+
+  def __init__(self, callback=None, batch_uri=None):
+    self.parts = []
+
+  def add(self, request, callback=None, request_id=None):
+    self.parts.append((request, callback, request_id))
+
+  def execute(self, http=None):
+    _FakeBatch.executed.append([request for request, _, _ in self.parts])
+    for request, callback, request_id in self.parts:
+      if request == 'down':
+        raise IOError('connection lost')
+      callback(request_id, {'request': request}, None)
+
+
+class WriteBehindTestCase(unittest.TestCase):
+
+  def setUp(self):
+    # Failed requests are logged as errors.
+    logging.disable(logging.ERROR)
+    _FakeBatch.executed = []
+    self.answers = []
+    self._saved = (
+        write_behind.api_metrics.MeteredBatchHttpRequest,
+        write_behind.discovery_cache.get_service,
+        write_behind.http_pool.PooledHttp)
+    write_behind.api_metrics.MeteredBatchHttpRequest = _FakeBatch
+    write_behind.discovery_cache.get_service = lambda *args: _FakeService()
+    write_behind.http_pool.PooledHttp = lambda: None
+
+  def tearDown(self):
+    logging.disable(logging.NOTSET)
+    (write_behind.api_metrics.MeteredBatchHttpRequest,
+     write_behind.discovery_cache.get_service,
+     write_behind.http_pool.PooledHttp) = self._saved
+
+  def _callback(self, request_id, response, exception):
+    self.answers.append((request_id, response, exception))
+
+
+class ExecuteBatchTest(WriteBehindTestCase):
+
+  def test_splits_requests_at_max_batch_size(self):
+    requests = [('r%d' % index, self._callback) for index in range(5)]
+    results = write_behind.execute_batch(requests, max_batch_size=2)
+    self.assertEqual(
+        [['r0', 'r1'], ['r2', 'r3'], ['r4']], _FakeBatch.executed)
+    self.assertEqual(5, results.success)
+    self.assertEqual(0, results.failure)
+    self.assertEqual(
+        ['0', '1', '2', '3', '4'],
+        [request_id for request_id, _, _ in self.answers])
+
+  def test_failed_batch_fails_its_unanswered_requests(self):
+    requests = [(request, self._callback)
+                for request in ['r0', 'down', 'r2', 'r3']]
+    results = write_behind.execute_batch(requests, max_batch_size=3)
+    # The batch after the failed one is still executed.
+    self.assertEqual([['r0', 'down', 'r2'], ['r3']], _FakeBatch.executed)
+    self.assertEqual(2, results.success)
+    self.assertEqual(2, results.failure)
+    answers = dict((request_id, (response, exception))
+                   for request_id, response, exception in self.answers)
+    self.assertEqual(({'request': 'r0'}, None), answers['0'])
+    self.assertIsNone(answers['1'][0])
+    self.assertIsInstance(answers['1'][1], IOError)
+    self.assertIsInstance(answers['2'][1], IOError)
+    self.assertEqual(({'request': 'r3'}, None), answers['3'])
+
+  def test_requests_without_callback_are_counted(self):
+    results = write_behind.execute_batch([('r0', None), ('down', None)])
+    self.assertEqual((1, 1), (results.success, results.failure))
+
+
+class WriteBehindDispatcherTest(WriteBehindTestCase):
+
+  def test_leader_flushes_requests_added_during_window(self):
+    dispatcher = write_behind.WriteBehindDispatcher(window=0.2)
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(dispatcher.add('r0', self._callback)))
+    leader.start()
+    time.sleep(0.05)
+    self.assertIsNone(dispatcher.add('r1', self._callback))
+    leader.join()
+    self.assertEqual([['r0', 'r1']], _FakeBatch.executed)
+    self.assertEqual(2, results[0].success)
+    self.assertEqual(2, len(self.answers))
+
+  def test_full_batch_is_flushed_right_away(self):
+    dispatcher = write_behind.WriteBehindDispatcher(
+        window=0.2, max_batch_size=2)
+    leader = threading.Thread(
+        target=lambda: dispatcher.add('r0', self._callback))
+    leader.start()
+    time.sleep(0.05)
+    results = dispatcher.add('r1', self._callback)
+    self.assertEqual([['r0', 'r1']], _FakeBatch.executed)
+    self.assertEqual(2, results.success)
+    leader.join()
+    # The leader finds nothing left to flush.
+    self.assertEqual([['r0', 'r1']], _FakeBatch.executed)
+
+  def test_failed_flush_reaches_callbacks_of_every_caller(self):
+    dispatcher = write_behind.WriteBehindDispatcher(window=0.2)
+    leader = threading.Thread(
+        target=lambda: dispatcher.add('down', self._callback))
+    leader.start()
+    time.sleep(0.05)
+    dispatcher.add('r1', self._callback)
+    leader.join()
+    self.assertEqual(2, len(self.answers))
+    for _, response, exception in self.answers:
+      self.assertIsNone(response)
+      self.assertIsInstance(exception, IOError)
+
+
+if __name__ == '__main__':
+  unittest.main()
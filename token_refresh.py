@@ -0,0 +1,81 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Refresh of OAuth 2.0 access tokens ahead of their expiry."""
+
+import datetime
+import logging
+
+from oauth2client.client import AccessTokenRefreshError
+
+from model import Credentials
+import credentials_cache
+import http_pool
+
+
+# Access tokens expiring within this delay are refreshed by the scheduler.
+REFRESH_AHEAD = datetime.timedelta(minutes=15)
+
+# Number of credentials refreshed per scheduler task.
+BATCH_SIZE = 50
+
+
+def refresh_expiring(now, cursor=None):
+  """Refreshes a batch of access tokens that are about to expire.
+
+  Credentials are scanned in token expiry order, which only needs the
+  built-in single property index on Credentials.token_expiry. A failure to
+  refresh the token of one user does not stop the batch.
+
+  Args:
+    now: Start time of the scan, as a UTC datetime. A cursor is only valid
+      for the query it came from, so a scan continues with the same time.
+    cursor: Datastore cursor returned by a previous call, or None.
+  Returns:
+    Cursor to continue the scan with, or None if the batch was the last one.
+  """
+  query = (Credentials.all()
+           .filter('token_expiry >', now)
+           .filter('token_expiry <', now + REFRESH_AHEAD)
+           .order('token_expiry'))
+  if cursor:
+    query.with_cursor(cursor)
+  entities = query.fetch(BATCH_SIZE)
+  for entity in entities:
+    try:
+      refresh(entity.key().name(), entity.credentials)
+    except Exception:
+      logging.exception(
+          'Failed to refresh access token of user %s', entity.key().name())
+  logging.info('Refreshed %d expiring access token(s)', len(entities))
+  if len(entities) < BATCH_SIZE:
+    return None
+  return query.cursor()
+
+
+def refresh(userid, credentials):
+  """Refreshes the access token of a user and stores the result.
+
+  Args:
+    userid: ID of the user owning the credentials.
+    credentials: OAuth2Credentials to refresh.
+  """
+  # Storing through the cached storage keeps both cache tiers up to date.
+  credentials.set_store(credentials_cache.get_storage(userid))
+  try:
+    credentials.refresh(http_pool.PooledHttp())
+  except AccessTokenRefreshError:
+    # Invalid credentials are stored without an expiry and are no longer
+    # picked up by the scheduler.
+    logging.warning('Could not refresh access token of user %s', userid)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmarks of the application's pure-Python hot paths.
+
+Each benchmark is timed over enough loops to last at least --min-time
+seconds, several times over; the best and median times per call are
+reported. Benchmarks whose modules or files cannot be loaded (jinja2 and
+webapp2 come with the App Engine SDK, util needs session.secret) are
+reported as skipped.
+
+    python tools/microbenchmarks.py --sdk /path/to/google_appengine \\
+        --json benchmarks.json
+
+The JSON output maps each benchmark to its results so that two runs can be
+compared number by number.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import time
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Secret used to sign cookies in the session benchmarks.
+COOKIE_SECRET = 'benchmark-secret-' + 'x' * 48
+
+_BENCHMARKS = []
+
+
+def benchmark(name):
+  """Registers a benchmark.
+
+  The decorated function sets the benchmark up and returns the callable to
+  time, taking no arguments.
+  """
+
+  def register(setup):
+    _BENCHMARKS.append((name, setup))
+    return setup
+  return register
+
+
+def _counter_item(num=0):
+  """Returns a counter timeline item."""
+  return {
+      'id': 'item-%d' % num,
+      'sourceItemId': json.dumps({'name': 'Counter', 'num': num}),
+      'html': (
+          '<article><section><p>Counter</p><p>%d</p></section></article>' %
+          num)
+  }
+
+
+@benchmark('custom_item_fields.encode')
+def _fields_encode():
+  import custom_item_fields
+  fields = {'name': 'Counter', 'num': 42}
+  return lambda: custom_item_fields.get_json_from_fields(fields)
+
+
+@benchmark('custom_item_fields.decode')
+def _fields_decode():
+  import custom_item_fields
+  item = _counter_item(42)
+  return lambda: custom_item_fields.get_fields_from_item(item)
+
+
+@benchmark('custom_item_fields.render_cached')
+def _fields_render_cached():
+  import custom_item_fields
+  fields = {'name': 'Counter', 'num': 42}
+  return lambda: custom_item_fields.render_html_from_fields(
+      fields, '/templates/card.html')
+
+
+@benchmark('custom_item_fields.render_uncached')
+def _fields_render_uncached():
+  import custom_item_fields
+  fields = {'name': 'Counter', 'num': 42}
+
+  def render():
+    custom_item_fields.RENDER_CACHE.delete(custom_item_fields._render_cache_key(
+        fields, '/templates/card.html'))
+    custom_item_fields.render_html_from_fields(fields, '/templates/card.html')
+  return render
+
+
+@benchmark('custom_item_fields.cycle')
+def _fields_cycle():
+  import custom_item_fields
+  item = _counter_item()
+
+  def cycle():
+    fields = custom_item_fields.FieldView(item, '/templates/card.html')
+    fields.set('num', (fields.get('num') + 1) % 10).commit()
+  return cycle
+
+
+def _handler(cookie=None):
+  """Returns a minimal request handler for LilCookies."""
+  import webapp2
+  request = webapp2.Request.blank('https://counter.example.com/')
+  if cookie:
+    request.headers['Cookie'] = cookie
+  return webapp2.RequestHandler(request, webapp2.Response())
+
+
+@benchmark('sessions.set_secure_cookie')
+def _set_secure_cookie():
+  import sessions
+  import webapp2
+  handler = _handler()
+
+  def set_cookie():
+    handler.response = webapp2.Response()
+    sessions.LilCookies(handler, COOKIE_SECRET).set_secure_cookie(
+        name='userid', value='123456789012345678901')
+  return set_cookie
+
+
+@benchmark('sessions.get_secure_cookie')
+def _get_secure_cookie():
+  import sessions
+  handler = _handler()
+  sessions.LilCookies(handler, COOKIE_SECRET).set_secure_cookie(
+      name='userid', value='123456789012345678901')
+  cookie = handler.response.headers['Set-Cookie'].split(';')[0]
+  handler = _handler(cookie)
+  return lambda: sessions.LilCookies(handler, COOKIE_SECRET).get_secure_cookie(
+      name='userid')
+
+
+@benchmark('util.get_full_url')
+def _get_full_url():
+  import util
+  handler = _handler()
+  return lambda: util.get_full_url(handler, '/static/images/up.png')
+
+
+@benchmark('apiclient.JsonModel.request')
+def _json_model_request():
+  from apiclient.model import JsonModel
+  model = JsonModel()
+  body = _counter_item(42)
+  return lambda: model.request({}, {'id': 'item-42'}, {}, body)
+
+
+@benchmark('apiclient.JsonModel.response')
+def _json_model_response():
+  import httplib2
+  from apiclient.model import JsonModel
+  model = JsonModel()
+  response = httplib2.Response({'status': 200})
+  content = json.dumps(_counter_item(42))
+  return lambda: model.response(response, content)
+
+
+def _index_benchmark(size):
+  """Registers a benchmark rendering index.html with size counters."""
+
+  @benchmark('templates.index_%d' % size)
+  def render_index():
+    import templating
+    template = templating.get_template('templates/index.html')
+    counters = [
+        {'id': 'item-%d' % index,
+         'sourceItemId': {'name': 'Counter %d' % index, 'num': index}}
+        for index in range(size)]
+    return lambda: ''.join(template.generate(
+        {'userId': 'user', 'timelineItems': counters}))
+
+
+for _size in (10, 100, 1000):
+  _index_benchmark(_size)
+
+
+def measure(function, min_time, repeat):
+  """Times function and returns its results per call."""
+  loops = 1
+  while True:
+    start = time.time()
+    for _ in xrange(loops):
+      function()
+    elapsed = time.time() - start
+    if elapsed >= min_time:
+      break
+    loops *= 10 if elapsed < min_time / 10 else 2
+  timings = [elapsed / loops]
+  for _ in range(repeat - 1):
+    start = time.time()
+    for _ in xrange(loops):
+      function()
+    timings.append((time.time() - start) / loops)
+  timings.sort()
+  return {
+      'loops': loops,
+      'best': timings[0],
+      'median': timings[len(timings) // 2],
+      'timings': timings
+  }
+
+
+def run(pattern=None, min_time=0.2, repeat=5):
+  """Runs the benchmarks whose name matches pattern."""
+  results = {}
+  for name, setup in _BENCHMARKS:
+    if pattern and not re.search(pattern, name):
+      continue
+    try:
+      function = setup()
+    except (ImportError, IOError), e:
+      results[name] = {'skipped': str(e)}
+      continue
+    results[name] = measure(function, min_time, repeat)
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '--sdk', default=os.environ.get('APPENGINE_SDK'),
+      help='path of the App Engine SDK (default: $APPENGINE_SDK)')
+  parser.add_argument('--filter', help='regular expression of benchmarks')
+  parser.add_argument('--min-time', type=float, default=0.2)
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--json', help='file to write the results to as JSON')
+  args = parser.parse_args()
+
+  if args.sdk:
+    sys.path.insert(0, args.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+  sys.path.insert(0, os.path.join(ROOT_DIR, 'lib'))
+  sys.path.insert(0, ROOT_DIR)
+  # util reads session.secret relative to the application directory.
+  os.chdir(ROOT_DIR)
+
+  results = run(args.filter, args.min_time, args.repeat)
+  for name, result in sorted(results.iteritems()):
+    if 'skipped' in result:
+      print '%-40s skipped: %s' % (name, result['skipped'])
+    else:
+      print '%-40s %12.2f us/call (median %.2f us)' % (
+          name, result['best'] * 1e6, result['median'] * 1e6)
+  if args.json:
+    with open(args.json, 'w') as results_file:
+      json.dump({
+          'python': platform.python_version(),
+          'time': time.time(),
+          'benchmarks': results
+      }, results_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
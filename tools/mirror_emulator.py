@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory stand-in for the Mirror API, for offline load testing.
+
+The emulator serves:
+
+  - the discovery documents bundled in discovery/, with their rootUrl
+    pointing at the emulator;
+  - timeline and subscriptions list/get/insert/update/patch/delete, with
+    one timeline per access token;
+  - batch requests;
+  - oauth2 userinfo, plus fake OAuth authorization and token endpoints that
+    accept any code or refresh token.
+
+Start it with:
+
+    python tools/mirror_emulator.py --port 8090 --latency 0.05
+
+and point the application at it by setting GOOGLE_API_ROOT_URL to
+http://localhost:8090/ (see discovery_cache) and the auth_uri and token_uri
+of client_secrets.json to http://localhost:8090/o/oauth2/auth and
+http://localhost:8090/o/oauth2/token.
+
+GET /emulator/stats returns the number of calls per API method and
+POST /emulator/reset clears all data and statistics.
+"""
+
+import argparse
+import BaseHTTPServer
+import collections
+import datetime
+import email.parser
+import json
+import os
+import random
+import re
+import SocketServer
+import threading
+import time
+import urllib
+import urlparse
+import uuid
+
+
+DISCOVERY_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'discovery')
+
+DEFAULT_MAX_RESULTS = 20
+
+
+class ApiError(Exception):
+  """Error returned to the client as a Google API error response."""
+
+  def __init__(self, status, message):
+    Exception.__init__(self, message)
+    self.status = status
+    self.message = message
+
+
+def _now():
+  """Returns the current time formatted as in Mirror API resources."""
+  return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _merge(target, patch):
+  """Merges a patch body into a resource, as PATCH does."""
+  for key, value in patch.iteritems():
+    if isinstance(value, dict) and isinstance(target.get(key), dict):
+      _merge(target[key], value)
+    else:
+      target[key] = value
+
+
+class MirrorEmulator(object):
+  """In-memory Mirror API state, latency and error injection."""
+
+  def __init__(self, latency=0, jitter=0, error_rate=0, error_status=503):
+    """Initialize a new MirrorEmulator.
+
+    Args:
+      latency: Seconds added to every HTTP request.
+      jitter: Maximum number of random seconds added to latency.
+      error_rate: Probability that an API call fails with error_status.
+      error_status: HTTP status of injected errors.
+    """
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.error_status = error_status
+    self._lock = threading.Lock()
+    self._routes = [
+        ('GET', r'/discovery/v1/apis/([^/]+)/([^/]+)/rest$', None,
+         self._discovery),
+        ('GET', r'/mirror/v1/timeline$', 'mirror.timeline.list',
+         self._timeline_list),
+        ('POST', r'/mirror/v1/timeline$', 'mirror.timeline.insert',
+         self._timeline_insert),
+        ('GET', r'/mirror/v1/timeline/([^/]+)$', 'mirror.timeline.get',
+         self._timeline_get),
+        ('PUT', r'/mirror/v1/timeline/([^/]+)$', 'mirror.timeline.update',
+         self._timeline_update),
+        ('PATCH', r'/mirror/v1/timeline/([^/]+)$', 'mirror.timeline.patch',
+         self._timeline_patch),
+        ('DELETE', r'/mirror/v1/timeline/([^/]+)$', 'mirror.timeline.delete',
+         self._timeline_delete),
+        ('GET', r'/mirror/v1/subscriptions$', 'mirror.subscriptions.list',
+         self._subscriptions_list),
+        ('POST', r'/mirror/v1/subscriptions$', 'mirror.subscriptions.insert',
+         self._subscriptions_insert),
+        ('GET', r'/mirror/v1/subscriptions/([^/]+)$',
+         'mirror.subscriptions.get', self._subscriptions_get),
+        ('PATCH', r'/mirror/v1/subscriptions/([^/]+)$',
+         'mirror.subscriptions.patch', self._subscriptions_patch),
+        ('PUT', r'/mirror/v1/subscriptions/([^/]+)$',
+         'mirror.subscriptions.update', self._subscriptions_update),
+        ('DELETE', r'/mirror/v1/subscriptions/([^/]+)$',
+         'mirror.subscriptions.delete', self._subscriptions_delete),
+        ('GET', r'/oauth2/v2/userinfo$', 'oauth2.userinfo.get',
+         self._userinfo),
+    ]
+    self.reset()
+
+  def reset(self):
+    """Clears all timelines, subscriptions and statistics."""
+    with self._lock:
+      self._timelines = collections.defaultdict(collections.OrderedDict)
+      self._subscriptions = collections.defaultdict(dict)
+    self.reset_stats()
+
+  def reset_stats(self):
+    """Clears the call statistics."""
+    with self._lock:
+      self.calls = collections.Counter()
+      self.errors = 0
+
+  def stats(self):
+    """Returns the call statistics."""
+    with self._lock:
+      return {
+          'calls': dict(self.calls),
+          'total': sum(self.calls.values()),
+          'errors': self.errors
+      }
+
+  def timeline(self, user):
+    """Returns a copy of a user's timeline items, newest first."""
+    with self._lock:
+      return [json.loads(json.dumps(item))
+              for item in reversed(self._timelines[user].values())]
+
+  def sleep(self):
+    """Waits for the configured latency."""
+    delay = self.latency + random.uniform(0, self.jitter)
+    if delay > 0:
+      time.sleep(delay)
+
+  def call(self, method, path, query, headers, body, root_url):
+    """Executes an API call.
+
+    Args:
+      method: HTTP method.
+      path: Request path.
+      query: Dict of query parameters.
+      headers: Dict of request headers with lowercase names.
+      body: Request body.
+      root_url: URL of the emulator, ending with '/'.
+    Returns:
+      (status, content type, content) tuple.
+    """
+    for route_method, pattern, method_id, handler in self._routes:
+      match = re.match(pattern, path)
+      if route_method != method or not match:
+        continue
+      try:
+        if method_id is None:
+          return 200, 'application/json', handler(root_url, *match.groups())
+        with self._lock:
+          self.calls[method_id] += 1
+          if random.random() < self.error_rate:
+            self.errors += 1
+            raise ApiError(self.error_status, 'Injected error')
+        user = self._user(headers)
+        data = json.loads(body) if body else None
+        with self._lock:
+          result = handler(user, query, data, *match.groups())
+      except ApiError, e:
+        return e.status, 'application/json', json.dumps({
+            'error': {
+                'errors': [{'message': e.message}],
+                'code': e.status,
+                'message': e.message
+            }
+        })
+      if result is None:
+        return 204, 'application/json', ''
+      return 200, 'application/json', json.dumps(result)
+    return 404, 'text/plain', 'Not Found'
+
+  def _user(self, headers):
+    """Returns the user owning the access token of a request."""
+    authorization = headers.get('authorization', '')
+    if not authorization.startswith('Bearer '):
+      raise ApiError(401, 'Login Required')
+    return authorization[len('Bearer '):]
+
+  def _discovery(self, root_url, api, version):
+    path = os.path.join(DISCOVERY_DIR, '%s.%s.json' % (api, version))
+    if not os.path.exists(path):
+      raise ApiError(404, 'Unknown API %s %s' % (api, version))
+    with open(path) as document_file:
+      document = json.load(document_file)
+    document['rootUrl'] = root_url
+    return json.dumps(document)
+
+  def _get_item(self, user, item_id):
+    item = self._timelines[user].get(item_id)
+    if item is None:
+      raise ApiError(404, 'Not Found')
+    return item
+
+  def _timeline_list(self, user, query, data):
+    items = list(reversed(self._timelines[user].values()))
+    start = int(query.get('pageToken') or 0)
+    end = start + int(query.get('maxResults') or DEFAULT_MAX_RESULTS)
+    result = {'kind': 'mirror#timeline', 'items': items[start:end]}
+    if end < len(items):
+      result['nextPageToken'] = str(end)
+    return result
+
+  def _timeline_insert(self, user, query, data):
+    item = dict(data or {})
+    item['id'] = uuid.uuid4().hex
+    item['kind'] = 'mirror#timelineItem'
+    item['created'] = item['updated'] = _now()
+    self._timelines[user][item['id']] = item
+    return item
+
+  def _timeline_get(self, user, query, data, item_id):
+    return self._get_item(user, item_id)
+
+  def _timeline_update(self, user, query, data, item_id):
+    item = self._get_item(user, item_id)
+    updated = dict(data or {})
+    updated.update(
+        id=item_id, kind=item['kind'], created=item['created'],
+        updated=_now())
+    self._timelines[user][item_id] = updated
+    return updated
+
+  def _timeline_patch(self, user, query, data, item_id):
+    item = self._get_item(user, item_id)
+    _merge(item, data or {})
+    item['updated'] = _now()
+    return item
+
+  def _timeline_delete(self, user, query, data, item_id):
+    self._get_item(user, item_id)
+    del self._timelines[user][item_id]
+
+  def _get_subscription(self, user, subscription_id):
+    subscription = self._subscriptions[user].get(subscription_id)
+    if subscription is None:
+      raise ApiError(404, 'Not Found')
+    return subscription
+
+  def _subscriptions_list(self, user, query, data):
+    return {
+        'kind': 'mirror#subscriptionsList',
+        'items': self._subscriptions[user].values()
+    }
+
+  def _subscriptions_insert(self, user, query, data):
+    subscription = dict(data or {})
+    subscription['id'] = subscription.get('collection')
+    subscription['kind'] = 'mirror#subscription'
+    subscription['updated'] = _now()
+    self._subscriptions[user][subscription['id']] = subscription
+    return subscription
+
+  def _subscriptions_get(self, user, query, data, subscription_id):
+    return self._get_subscription(user, subscription_id)
+
+  def _subscriptions_update(self, user, query, data, subscription_id):
+    self._get_subscription(user, subscription_id)
+    subscription = dict(data or {})
+    subscription.update(
+        id=subscription_id, kind='mirror#subscription', updated=_now())
+    self._subscriptions[user][subscription_id] = subscription
+    return subscription
+
+  def _subscriptions_patch(self, user, query, data, subscription_id):
+    subscription = self._get_subscription(user, subscription_id)
+    _merge(subscription, data or {})
+    subscription['updated'] = _now()
+    return subscription
+
+  def _subscriptions_delete(self, user, query, data, subscription_id):
+    if self._subscriptions[user].pop(subscription_id, None) is None:
+      raise ApiError(404, 'Not Found')
+
+  def _userinfo(self, user, query, data):
+    return {'id': user, 'name': user}
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """HTTP front end of the emulator."""
+
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET(self):
+    self._handle()
+
+  def do_POST(self):
+    self._handle()
+
+  def do_PUT(self):
+    self._handle()
+
+  def do_PATCH(self):
+    self._handle()
+
+  def do_DELETE(self):
+    self._handle()
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+  def _handle(self):
+    emulator = self.server.emulator
+    parsed = urlparse.urlparse(self.path)
+    length = int(self.headers.get('content-length') or 0)
+    body = self.rfile.read(length) if length else ''
+    headers = dict(
+        (name.lower(), value) for name, value in self.headers.items())
+    emulator.sleep()
+
+    if parsed.path == '/emulator/stats':
+      self._respond(200, 'application/json', json.dumps(emulator.stats()))
+    elif parsed.path == '/emulator/reset':
+      emulator.reset()
+      self._respond(204, 'text/plain', '')
+    elif parsed.path == '/batch':
+      self._batch(headers, body)
+    elif parsed.path == '/o/oauth2/auth':
+      self._authorize(dict(urlparse.parse_qsl(parsed.query)))
+    elif parsed.path == '/o/oauth2/token':
+      self._token(dict(urlparse.parse_qsl(body)))
+    else:
+      self._respond(*emulator.call(
+          self.command, parsed.path, dict(urlparse.parse_qsl(parsed.query)),
+          headers, body, self._root_url()))
+
+  def _root_url(self):
+    return 'http://%s/' % self.headers.get('host')
+
+  def _respond(self, status, content_type, content, headers=None):
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(content)))
+    for name, value in (headers or {}).iteritems():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(content)
+
+  def _authorize(self, params):
+    """Grants authorization right away, as user 'emulated-user'."""
+    query = {'code': params.get('login_hint', 'emulated-user')}
+    if 'state' in params:
+      query['state'] = params['state']
+    location = params.get('redirect_uri', '/') + '?' + urllib.urlencode(query)
+    self._respond(302, 'text/plain', '', {'Location': location})
+
+  def _token(self, params):
+    """Issues an access token equal to the code or refresh token."""
+    if params.get('grant_type') == 'authorization_code':
+      user = params.get('code')
+    else:
+      user = params.get('refresh_token')
+    self._respond(200, 'application/json', json.dumps({
+        'access_token': user,
+        'refresh_token': user,
+        'token_type': 'Bearer',
+        'expires_in': 3600
+    }))
+
+  def _batch(self, headers, body):
+    """Executes the parts of a multipart/mixed batch request."""
+    emulator = self.server.emulator
+    parser = email.parser.FeedParser()
+    parser.feed('Content-Type: %s\r\n\r\n' % headers.get('content-type'))
+    parser.feed(body)
+    boundary = uuid.uuid4().hex
+    parts = []
+    for part in parser.close().get_payload():
+      request_line, payload = part.get_payload().split('\n', 1)
+      method, uri, _ = request_line.split(' ', 2)
+      parser = email.parser.FeedParser()
+      parser.feed(payload)
+      message = parser.close()
+      parsed = urlparse.urlparse(uri)
+      status, content_type, content = emulator.call(
+          method, parsed.path, dict(urlparse.parse_qsl(parsed.query)),
+          dict((name.lower(), value) for name, value in message.items()),
+          message.get_payload(), self._root_url())
+      parts.append(
+          '--%s\r\n'
+          'Content-Type: application/http\r\n'
+          'Content-ID: <response-%s\r\n'
+          '\r\n'
+          'HTTP/1.1 %d %s\r\n'
+          'Content-Type: %s\r\n'
+          'Content-Length: %d\r\n'
+          '\r\n'
+          '%s\r\n' % (
+              boundary, part['Content-ID'][1:], status,
+              self.responses.get(status, ('',))[0], content_type,
+              len(content), content))
+    parts.append('--%s--\r\n' % boundary)
+    self._respond(
+        200, 'multipart/mixed; boundary=%s' % boundary, ''.join(parts))
+
+
+class EmulatorServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """Multi-threaded HTTP server running a MirrorEmulator."""
+
+  daemon_threads = True
+  request_queue_size = 128
+
+  def __init__(self, address, emulator, verbose=False):
+    BaseHTTPServer.HTTPServer.__init__(self, address, _RequestHandler)
+    self.emulator = emulator
+    self.verbose = verbose
+
+  @property
+  def root_url(self):
+    """Root URL of the emulated APIs, ending with '/'."""
+    return 'http://%s:%d/' % self.server_address
+
+
+def start(port=0, **kwargs):
+  """Starts an emulator on a background thread.
+
+  Args:
+    port: Port to listen on, or 0 to pick a free one.
+    **kwargs: Latency and error injection arguments of MirrorEmulator.
+  Returns:
+    The running EmulatorServer.
+  """
+  server = EmulatorServer(('127.0.0.1', port), MirrorEmulator(**kwargs))
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8090)
+  parser.add_argument(
+      '--latency', type=float, default=0,
+      help='seconds added to every HTTP request')
+  parser.add_argument(
+      '--jitter', type=float, default=0,
+      help='maximum random seconds added to the latency')
+  parser.add_argument(
+      '--error-rate', type=float, default=0,
+      help='probability that an API call fails')
+  parser.add_argument(
+      '--error-status', type=int, default=503,
+      help='HTTP status of injected errors')
+  parser.add_argument('--verbose', action='store_true')
+  args = parser.parse_args()
+
+  emulator = MirrorEmulator(
+      latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+      error_status=args.error_status)
+  server = EmulatorServer((args.host, args.port), emulator, args.verbose)
+  print 'Mirror API emulator listening on %s' % server.root_url
+  server.serve_forever()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Notification storm load test for /notify.
+
+Replays synthetic notifications (a mix of increment, decrement and reset
+menu selections from many users, concentrated on a few hot items) against
+the WSGI application of main.py at a fixed concurrency. The App Engine
+services are provided by the SDK's testbed stubs and the Mirror API by
+tools/mirror_emulator.py. Run it from the application directory:
+
+    python tools/notify_load_test.py --sdk /path/to/google_appengine \\
+        --notifications 2000 --concurrency 20 --json results.json
+
+The report gives the acknowledgement throughput and latency percentiles of
+/notify, the time taken to process every notification and project the
+counters on their cards, the Mirror API calls made per notification and the
+number of lost updates: the difference between the expected and the actual
+values of the counters that were never reset, in the counter store and on
+the cards.
+"""
+
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+OPTIONS = ('increment', 'decrement', 'reset')
+
+
+def _setup_path(sdk_path):
+  """Makes the SDK, the application and its libraries importable."""
+  sys.path.insert(0, sdk_path)
+  import dev_appserver
+  dev_appserver.fix_sys_path()
+  sys.path.insert(0, os.path.join(ROOT_DIR, 'lib'))
+  sys.path.insert(0, ROOT_DIR)
+  sys.path.insert(0, os.path.join(ROOT_DIR, 'tools'))
+  # util reads session.secret relative to the application directory.
+  os.chdir(ROOT_DIR)
+
+
+def _setup_testbed():
+  """Activates the App Engine service stubs used by the application."""
+  from google.appengine.datastore import datastore_stub_util
+  from google.appengine.ext import testbed
+
+  bed = testbed.Testbed()
+  bed.activate()
+  bed.init_datastore_v3_stub(
+      consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+          probability=1))
+  bed.init_memcache_stub()
+  bed.init_taskqueue_stub(root_path=ROOT_DIR)
+  return bed
+
+
+def percentile(values, fraction):
+  """Returns the value below which fraction of the sorted values fall."""
+  if not values:
+    return None
+  index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+  return values[index]
+
+
+class LoadTest(object):
+  """Seeds users and counters, replays notifications and checks the result."""
+
+  def __init__(self, args, emulator_root):
+    self.args = args
+    self.emulator_root = emulator_root
+    self.items = []
+    self.latencies = []
+    self.statuses = collections.Counter()
+    self._lock = threading.Lock()
+
+  def _service(self, userid):
+    """Returns a Mirror service authorized as userid on the emulator."""
+    import credentials_cache
+    import util
+    return util.create_service(
+        'mirror', 'v1', credentials_cache.get_storage(userid).get())
+
+  def seed(self):
+    """Stores credentials for every user and inserts their counters."""
+    import credentials_cache
+    import custom_item_fields
+    from main_handler import TIMELINE_ITEM_TEMPLATE_URL
+    from oauth2client.client import OAuth2Credentials
+
+    for user_index in range(self.args.users):
+      userid = 'load-user-%d' % user_index
+      # The emulator accepts any token and uses it as the user.
+      credentials_cache.get_storage(userid).put(OAuth2Credentials(
+          userid, 'client-id', 'client-secret', userid, None,
+          self.emulator_root + 'o/oauth2/token', 'notify-load-test'))
+      service = self._service(userid)
+      for counter_index in range(self.args.counters_per_user):
+        body = custom_item_fields.set_multiple(
+            {}, {'name': 'Counter %d' % counter_index, 'num': 0},
+            TIMELINE_ITEM_TEMPLATE_URL)
+        item = service.timeline().insert(body=body).execute()
+        self.items.append((userid, item['id']))
+
+  def notifications(self):
+    """Returns the synthetic notifications to replay."""
+    rng = random.Random(self.args.seed)
+    hot = self.items[:max(1, int(len(self.items) * self.args.hot_items))]
+    weights = [self.args.increments, self.args.decrements, self.args.resets]
+    notifications = []
+    for _ in range(self.args.notifications):
+      if rng.random() < self.args.hot_traffic:
+        userid, item_id = rng.choice(hot)
+      else:
+        userid, item_id = rng.choice(self.items)
+      option = _weighted_choice(rng, OPTIONS, weights)
+      notifications.append({
+          'collection': 'timeline',
+          'itemId': item_id,
+          'operation': 'UPDATE',
+          'userToken': userid,
+          'userActions': [{'type': 'CUSTOM', 'payload': option}]
+      })
+    return notifications
+
+  def replay(self, notifications):
+    """Posts the notifications to /notify from concurrent threads."""
+    import main
+    import webapp2
+
+    pending = collections.deque(notifications)
+
+    def worker():
+      while True:
+        with self._lock:
+          if not pending:
+            return
+          notification = pending.popleft()
+        request = webapp2.Request.blank(
+            '/notify', POST=json.dumps(notification))
+        request.method = 'POST'
+        request.content_type = 'application/json'
+        start = time.time()
+        response = request.get_response(main.app)
+        latency = time.time() - start
+        with self._lock:
+          self.latencies.append(latency)
+          self.statuses[response.status_int] += 1
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(self.args.concurrency)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+  def drain(self, bed):
+    """Processes queued notifications and runs the queued tasks."""
+    import main
+    import webapp2
+    from google.appengine.ext import testbed
+    from notify.handler import NOTIFICATION_QUEUE
+
+    NOTIFICATION_QUEUE.join()
+    taskqueue_stub = bed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    while True:
+      tasks = []
+      for queue in taskqueue_stub.GetQueues():
+        tasks.extend(taskqueue_stub.get_filtered_tasks(
+            queue_names=[queue['name']]))
+        taskqueue_stub.FlushQueue(queue['name'])
+      if not tasks:
+        return
+
+      def run(task):
+        request = webapp2.Request.blank(task.url, POST=task.payload)
+        request.method = 'POST'
+        for name, value in task.headers.iteritems():
+          request.headers[name] = value
+        request.get_response(main.app)
+
+      # Projections run concurrently so that their card updates are batched.
+      threads = [threading.Thread(target=run, args=(task,)) for task in tasks]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+  def lost_updates(self, notifications):
+    """Compares the counters that were never reset with the notifications."""
+    import counter_store
+    import custom_item_fields
+
+    expected = collections.Counter()
+    reset = set()
+    for notification in notifications:
+      option = notification['userActions'][0]['payload']
+      if option == 'reset':
+        reset.add(notification['itemId'])
+      else:
+        expected[notification['itemId']] += 1 if option == 'increment' else -1
+
+    checked = store_lost = card_lost = 0
+    for userid, item_id in self.items:
+      if item_id in reset or item_id not in expected:
+        continue
+      checked += 1
+      counter = counter_store.get(item_id)
+      stored = counter_store.get_value(counter) if counter else 0
+      store_lost += abs(expected[item_id] - stored)
+      item = self._service(userid).timeline().get(id=item_id).execute()
+      card = custom_item_fields.FieldView(item).get('num', 0)
+      card_lost += abs(expected[item_id] - card)
+    return {
+        'counters_checked': checked,
+        'store': store_lost,
+        'cards': card_lost
+    }
+
+
+def _weighted_choice(rng, choices, weights):
+  """Returns one of choices, picked with the given relative weights."""
+  threshold = rng.uniform(0, sum(weights))
+  for choice, weight in zip(choices, weights):
+    threshold -= weight
+    if threshold <= 0:
+      return choice
+  return choices[-1]
+
+
+def run(args):
+  """Runs the load test and returns its results."""
+  _setup_path(args.sdk)
+  bed = _setup_testbed()
+
+  import mirror_emulator
+  server = None
+  emulator_root = args.api_root
+  if not emulator_root:
+    server = mirror_emulator.start(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    emulator_root = server.root_url
+  os.environ['GOOGLE_API_ROOT_URL'] = emulator_root
+  # Notifications are processed on threads of this process rather than by
+  # the task queue stub, which does not run tasks by itself.
+  os.environ['NOTIFY_QUEUE_BACKEND'] = 'local'
+
+  test = LoadTest(args, emulator_root)
+  test.seed()
+  notifications = test.notifications()
+  if server:
+    server.emulator.reset_stats()
+
+  start = time.time()
+  test.replay(notifications)
+  acknowledged = time.time() - start
+  test.drain(bed)
+  processed = time.time() - start
+
+  api_calls = server.emulator.stats() if server else None
+  latencies = sorted(test.latencies)
+  results = {
+      'notifications': len(notifications),
+      'concurrency': args.concurrency,
+      'statuses': dict(test.statuses),
+      'ack_seconds': acknowledged,
+      'ack_throughput': len(notifications) / acknowledged,
+      'ack_latency': {
+          'p50': percentile(latencies, 0.5),
+          'p95': percentile(latencies, 0.95),
+          'p99': percentile(latencies, 0.99),
+          'max': latencies[-1] if latencies else None
+      },
+      'processed_seconds': processed,
+      'processed_throughput': len(notifications) / processed,
+      'lost_updates': test.lost_updates(notifications)
+  }
+  if api_calls is not None:
+    results['api_calls'] = api_calls
+    results['api_calls_per_notification'] = (
+        float(api_calls['total']) / len(notifications))
+  bed.deactivate()
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument(
+      '--sdk', default=os.environ.get('APPENGINE_SDK', ''),
+      help='path of the App Engine SDK (default: $APPENGINE_SDK)')
+  parser.add_argument(
+      '--api-root',
+      help='root URL of a running emulator (default: start one in-process)')
+  parser.add_argument('--users', type=int, default=20)
+  parser.add_argument('--counters-per-user', type=int, default=5)
+  parser.add_argument('--notifications', type=int, default=1000)
+  parser.add_argument('--concurrency', type=int, default=20)
+  parser.add_argument(
+      '--hot-items', type=float, default=0.05,
+      help='fraction of the counters that are hot')
+  parser.add_argument(
+      '--hot-traffic', type=float, default=0.8,
+      help='fraction of the notifications sent to hot counters')
+  parser.add_argument('--increments', type=float, default=70)
+  parser.add_argument('--decrements', type=float, default=25)
+  parser.add_argument('--resets', type=float, default=5)
+  parser.add_argument(
+      '--latency', type=float, default=0.05,
+      help='seconds of latency of the in-process emulator')
+  parser.add_argument('--jitter', type=float, default=0.02)
+  parser.add_argument('--error-rate', type=float, default=0)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--json', help='file to write the results to as JSON')
+  args = parser.parse_args()
+
+  results = run(args)
+  print json.dumps(results, indent=2, sort_keys=True)
+  if args.json:
+    with open(args.json, 'w') as results_file:
+      json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
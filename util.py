@@ -19,12 +19,13 @@ __author__ = 'alainv@google.com (Alain Vongsouvanh)'
 
 from urlparse import urlparse
 
-import httplib2
-from apiclient.discovery import build
-from oauth2client.appengine import StorageByKeyName
 import sessions
 
-from model import Credentials
+import credentials_cache
+import discovery_cache
+import http_pool
+import lru_cache
+import stats
 
 
 # Load the secret that is used for client side sessions
@@ -32,6 +33,17 @@ from model import Credentials
 # python -c "import os; print os.urandom(64)" > session.secret
 SESSION_SECRET = open('session.secret').read()
 
+# Number of recently verified signed cookies kept by each instance.
+VERIFIED_COOKIES_SIZE = 1000
+
+# Seconds a verified cookie is trusted without checking its signature again.
+VERIFIED_COOKIES_TTL = 300
+
+# Values of verified signed cookies, keyed by cookie name and Cookie header,
+# so that repeat requests skip both cookie parsing and the HMAC check.
+VERIFIED_COOKIES = lru_cache.LRUCache(
+    VERIFIED_COOKIES_SIZE, ttl=VERIFIED_COOKIES_TTL)
+
 
 def get_full_url(request_handler, path):
   """Return the full url from the provided request handler and path."""
@@ -39,27 +51,50 @@ def get_full_url(request_handler, path):
   return '%s://%s%s' % (pr.scheme, pr.netloc, path)
 
 
+def get_session(request_handler):
+  """Return the session of the current request, created once per request."""
+  registry = request_handler.request.registry
+  session = registry.get('session')
+  if session is None:
+    session = registry['session'] = sessions.LilCookies(
+        request_handler, SESSION_SECRET)
+  return session
+
+
+def get_secure_cookie(request_handler, name):
+  """Return the value of a signed cookie if it validates, or None."""
+  header = request_handler.request.headers.get('Cookie')
+  if not header:
+    return None
+  key = (name, header)
+  value = VERIFIED_COOKIES.get(key)
+  if value is None:
+    value = get_session(request_handler).get_secure_cookie(name=name)
+    if value:
+      VERIFIED_COOKIES.set(key, value)
+  return value
+
+
 def load_session_credentials(request_handler):
   """Load credentials from the current session."""
-  session = sessions.LilCookies(request_handler, SESSION_SECRET)
-  userid = session.get_secure_cookie(name='userid')
+  userid = get_secure_cookie(request_handler, 'userid')
   if userid:
-    return userid, StorageByKeyName(Credentials, userid, 'credentials').get()
+    return userid, credentials_cache.get_storage(userid).get()
   else:
     return None, None
 
 
 def store_userid(request_handler, userid):
   """Store current user's ID in session."""
-  session = sessions.LilCookies(request_handler, SESSION_SECRET)
-  session.set_secure_cookie(name='userid', value=userid)
+  get_session(request_handler).set_secure_cookie(name='userid', value=userid)
 
 
+@stats.timed('util.create_service')
 def create_service(service, version, creds=None):
   """Create a Google API service.
 
-  Load an API service from a discovery document and authorize it with the
-  provided credentials.
+  Load an API service from the process-wide discovery cache and authorize it
+  with the provided credentials.
 
   Args:
     service: Service name (e.g 'mirror', 'oauth2').
@@ -68,22 +103,24 @@ def create_service(service, version, creds=None):
   Returns:
     Authorized Google API service.
   """
-  # Instantiate an Http instance
-  http = httplib2.Http()
+  # Connections come from the process-wide keep-alive pool; only this
+  # request-scoped facade is authorized with the user's credentials.
+  http = http_pool.PooledHttp()
 
   if creds:
     # Authorize the Http instance with the passed credentials
     creds.authorize(http)
 
-  return build(service, version, http=http)
+  return discovery_cache.build(service, version, http)
 
 
 def auth_required(handler_method):
   """A decorator to require that the user has authorized the Glassware."""
 
   def check_auth(self, *args):
-    self.userid, self.credentials = load_session_credentials(self)
-    self.mirror_service = create_service('mirror', 'v1', self.credentials)
+    with stats.timed('util.auth_required'):
+      self.userid, self.credentials = load_session_credentials(self)
+      self.mirror_service = create_service('mirror', 'v1', self.credentials)
     # TODO: Also check that credentials are still valid.
     if not self.credentials:
       self.redirect('/auth')
@@ -0,0 +1,178 @@
+# Copyright (C) 2013 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Write-behind dispatcher batching timeline mutations across users.
+
+Requests built from any user's service (e.g.
+mirror_service.timeline().patch(...)) are collected for a short window and
+sent together through apiclient.http.BatchHttpRequest. Each request keeps the
+credentials of the service it was built from, so one batch can carry the
+mutations of many users.
+"""
+
+import logging
+import threading
+import time
+
+import api_metrics
+import discovery_cache
+import http_pool
+
+
+# Seconds the first request of a batch waits for others to join it.
+FLUSH_WINDOW = 0.5
+
+# Maximum number of calls Google APIs accept in a single batch request.
+MAX_BATCH_SIZE = 1000
+
+
+class BatchCallback(object):
+  """Class used to track batch request responses."""
+
+  def __init__(self):
+    """Initialize a new BatchCallback object."""
+    self.success = 0
+    self.failure = 0
+
+  def callback(self, request_id, response, exception):
+    """Method called on each HTTP Response from a batch request.
+
+    For more information, see
+      https://developers.google.com/api-client-library/python/guide/batch
+    """
+    if exception is None:
+      self.success += 1
+    else:
+      self.failure += 1
+      logging.error('Batched request %s failed: %s', request_id, exception)
+
+
+class WriteBehindDispatcher(object):
+  """Collects API requests and executes them in batches."""
+
+  def __init__(self, window=FLUSH_WINDOW, max_batch_size=MAX_BATCH_SIZE):
+    """Initialize a new WriteBehindDispatcher.
+
+    Args:
+      window: Seconds to wait for more requests before flushing.
+      max_batch_size: Maximum number of requests per batch request.
+    """
+    self._window = window
+    self._max_batch_size = max_batch_size
+    self._pending = []
+    self._lock = threading.Lock()
+
+  def add(self, request, callback=None):
+    """Adds a request to the next batch.
+
+    The caller adding the first request of a batch waits for the window and
+    then flushes it; a caller filling a batch up flushes it right away. All
+    other callers return immediately.
+
+    Args:
+      request: apiclient.http.HttpRequest to execute.
+      callback: Optional callable of the form callback(id, response,
+        exception) called with the result of this request.
+    Returns:
+      BatchCallback with the results of the flush performed by this call, or
+      None if the request was left for another caller to flush.
+    """
+    full = None
+    with self._lock:
+      self._pending.append((request, callback))
+      leader = len(self._pending) == 1
+      if len(self._pending) >= self._max_batch_size:
+        full = self._take()
+    if full is not None:
+      return self._execute(full)
+    if leader:
+      time.sleep(self._window)
+      return self.flush()
+    return None
+
+  def flush(self):
+    """Executes all pending requests and returns their BatchCallback."""
+    with self._lock:
+      pending = self._take()
+    return self._execute(pending)
+
+  def _take(self):
+    """Returns the pending requests and starts a new batch."""
+    pending = self._pending
+    self._pending = []
+    return pending
+
+  def _execute(self, pending):
+    """Executes requests in batches of at most max_batch_size requests."""
+    results = execute_batch(pending, self._max_batch_size)
+    if pending:
+      logging.info(
+          'Flushed %d batched request(s): %d succeeded, %d failed',
+          len(pending), results.success, results.failure)
+    return results
+
+
+class _BatchPart(object):
+  """Request of a batch request, remembering whether it was answered."""
+
+  def __init__(self, request_id, callback, results):
+    self.request_id = request_id
+    self.answered = False
+    self._callback = callback
+    self._results = results
+
+  def callback(self, request_id, response, exception):
+    """Records the result of the request, then calls its callback."""
+    self.answered = True
+    self._results.callback(request_id, response, exception)
+    if self._callback is not None:
+      self._callback(request_id, response, exception)
+
+
+def execute_batch(requests, max_batch_size=MAX_BATCH_SIZE):
+  """Executes API requests as batch requests right away.
+
+  If a batch request fails as a whole, each of its requests that was not
+  answered yet gets the exception through its callback.
+
+  Args:
+    requests: List of (request, callback) pairs, where callback is None or a
+      callable of the form callback(id, response, exception).
+    max_batch_size: Maximum number of requests per batch request.
+  Returns:
+    BatchCallback with the results of the requests.
+  """
+  results = BatchCallback()
+  batch_uri = discovery_cache.get_service('mirror', 'v1').batch_uri
+  for start in range(0, len(requests), max_batch_size):
+    batch = api_metrics.MeteredBatchHttpRequest(batch_uri=batch_uri)
+    parts = []
+    for index, (request, callback) in enumerate(
+        requests[start:start + max_batch_size]):
+      part = _BatchPart(str(start + index), callback, results)
+      parts.append(part)
+      batch.add(request, callback=part.callback, request_id=part.request_id)
+    try:
+      # Each request is authorized by its own http object; the batch itself
+      # only needs a connection.
+      batch.execute(http=http_pool.PooledHttp())
+    except Exception as e:
+      logging.exception('Batch request of %d request(s) failed', len(parts))
+      for part in parts:
+        if not part.answered:
+          part.callback(part.request_id, None, e)
+  return results
+
+
+TIMELINE_WRITER = WriteBehindDispatcher()